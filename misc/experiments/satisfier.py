@@ -5,8 +5,10 @@
 # > idea: have option to poll a certain proportion of the requirements
 # > idea: reduce priority once requirement has no further ideas to add (update ease to bias)
 
-from random import random
-from typing import Any, Callable, Tuple
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from random import random, seed as seed_random
+from typing import Any, Callable, Optional, Tuple
 
 import numpy as np
 
@@ -23,6 +25,88 @@ class RequirementInfo:
     def priority(self) -> int:
         return self.importance * ((1-self.satisfaction)/(4*self.satisfaction+1)) * self.ease
 
+class RequirementTracker:
+    """A struct-of-arrays tracker of the information of many requirements, backed by NumPy arrays.
+
+    The importance, ease and satisfaction of the requirements are kept in one array each, so priorities and total satisfaction are computed in single vectorized expressions, and the requirements with the highest priority are found by partial selection instead of sorting all of them.
+
+    Parameters
+    ----------
+    requirements : list[Callable[[Any], Tuple[float, Callable[[Any], Any]]]]
+        The requirements to track.
+    importance : list[int]
+        The importance of each requirement.
+    satisfaction : list[float]
+        The initial satisfaction of each requirement.
+    """
+    def __init__(self, requirements: list[Callable[[Any], Tuple[float, Callable[[Any], Any]]]], importance: list[int], satisfaction: list[float]):
+        self.requirements = list(requirements)
+        self.importance = np.asarray(importance, dtype=float)
+        self.ease = np.ones(len(self.requirements))
+        self.satisfaction = np.asarray(satisfaction, dtype=float)
+
+    def __len__(self) -> int:
+        return len(self.requirements)
+
+    @property
+    def priority(self) -> np.ndarray:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self.importance * ((1-self.satisfaction)/(4*self.satisfaction+1)) * self.ease
+
+    def is_satisfied(self) -> bool:
+        """Determines whether all of the requirements are satisfied."""
+        return bool(np.all(self.satisfaction >= 1))
+
+    def get_satisfaction(self) -> float:
+        """Gets the satisfaction of all of the requirements, weighted by their importance."""
+        return float(self.satisfaction @ self.importance)
+
+    def evaluate(self, state: Any) -> np.ndarray:
+        """Evaluates the satisfaction of each requirement for a state, clipped to [0, 1]."""
+        return np.clip(np.fromiter((requirement(state)[0] for requirement in self.requirements), dtype=float, count=len(self.requirements)), 0, 1)
+
+    def find_satisfaction(self, state: Any) -> Tuple[float, np.ndarray]:
+        """Gets the satisfaction of all of the requirements for a potential state to evaluate, and the satisfaction of each requirement, so that it can be kept with `set_satisfaction` without evaluating the requirements again."""
+        satisfaction = self.evaluate(state)
+        return float(satisfaction @ self.importance), satisfaction
+
+    def set_satisfaction(self, satisfaction: np.ndarray) -> None:
+        """Sets the satisfaction of each requirement, as found by `find_satisfaction`."""
+        self.satisfaction = satisfaction
+
+    def update_satisfaction(self, state: Any) -> None:
+        """Updates the satisfaction of all of the requirements, given a state to evaluate."""
+        self.satisfaction = self.evaluate(state)
+
+    def iter_by_priority(self, chunk_size: int=64):
+        """Iterates over the positions of the requirements from the highest to the lowest priority, with ties in order of position, as a stable sort would.
+
+        The priorities are computed once, and the requirements are selected `chunk_size` at a time with `np.partition`, so finding the first candidates doesn't sort all of the requirements. NaN priorities come last, as if they were -inf.
+        """
+        priority = self.priority
+        # NaN compares false to the threshold, so it would never be selected
+        priority = np.where(np.isnan(priority), -np.inf, priority)
+        remaining = np.arange(len(priority))
+        while len(remaining):
+            values = priority[remaining]
+            if len(values) > chunk_size:
+                # the chunk_size-th highest priority, and the highest priorities, taking ties in order of position
+                threshold = np.partition(values, len(values) - chunk_size)[len(values) - chunk_size]
+                above = np.flatnonzero(values > threshold)
+                ties = np.flatnonzero(values == threshold)[:chunk_size - len(above)]
+                selected = np.sort(np.concatenate([above, ties]))
+            else:
+                selected = np.arange(len(values))
+            chosen = selected[np.argsort(-values[selected], kind='stable')]
+            yield from remaining[chosen].tolist()
+            keep = np.ones(len(remaining), dtype=bool)
+            keep[chosen] = False
+            remaining = remaining[keep]
+
+    def to_dict(self) -> dict:
+        """Gets a dictionary of how well each of the requirements is satisfied, by position."""
+        return dict(enumerate(self.satisfaction.tolist()))
+
 def is_satisfied(requirement_tracker: list[RequirementInfo]) -> bool:
     """Determines whether all of the requirements in the tracker are satisfied.
     
@@ -90,7 +174,7 @@ def update_satisfaction(requirement_tracker: list[RequirementInfo], state: Any)
         info.satisfaction = max(0, min(1, info.requirement(state)[0]))
     return
 
-def apply_requirements(requirements: list[Callable[[Any], Tuple[float, Callable[[Any], Any]]]], initial_state: Any, importance: list[int], stalemate_threshold: int=5) -> Tuple[Any, dict]:
+def apply_requirements(requirements: list[Callable[[Any], Tuple[float, Callable[[Any], Any]]]], initial_state: Any, importance: list[int], stalemate_threshold: int=5, time_budget: Optional[float]=None, verbose: bool=True) -> Tuple[Any, dict]:
     """Applies the requirements to the initial state, returning the final state and a dictionary of how the requirements were satisfied.
     
     Parameters
@@ -103,6 +187,10 @@ def apply_requirements(requirements: list[Callable[[Any], Tuple[float, Callable[
         A list of importance values for the requirements. More important requirements will get more consideration when calculating the satisfaction score.
     stalemate_count : int, optional
         The number of times to try to apply the requirements to the state without improvements before giving up. The default is 5.
+    time_budget : float, optional
+        The number of seconds after which to give up, and return the best state found so far. The default is no limit.
+    verbose : bool, optional
+        Whether to print the stalemate count and the state on every iteration. The default is True.
 
     Returns
     -------
@@ -112,40 +200,166 @@ def apply_requirements(requirements: list[Callable[[Any], Tuple[float, Callable[
 
     if importance is None: importance = [1] * len(requirements)
     state = initial_state
-    
+    deadline = time.time() + time_budget if time_budget is not None else None
+
     # initiate the requirement tracking
-    requirement_tracker = []
-    for requirement, importance in zip(requirements, importance):
-        satisfaction, _ = requirement(state)
-        requirement_tracker.append(RequirementInfo(len(requirement_tracker), importance, 1, requirement, satisfaction))
+    requirement_tracker = RequirementTracker(requirements, importance, [requirement(state)[0] for requirement in requirements])
 
     stalemate_count = 0
-    while(not is_satisfied(requirement_tracker) and stalemate_count < stalemate_threshold):
+    while(not requirement_tracker.is_satisfied() and stalemate_count < stalemate_threshold and (deadline is None or time.time() < deadline)):
         # track whether the rating improvement process has stalled
-        current_satisfaction = get_satisfaction(requirement_tracker)
+        current_satisfaction = requirement_tracker.get_satisfaction()
         new_satisfaction = current_satisfaction
 
-        print(stalemate_count, state)
+        if verbose:
+            print(stalemate_count, state)
 
         # find the highest priority requirement and evaluate its proposal via the other requirements
-        for info in sorted(requirement_tracker, key=lambda x: x.priority, reverse=True):
-            _, proposal = info.requirement(state)
+        for position in requirement_tracker.iter_by_priority():
+            if deadline is not None and time.time() >= deadline:
+                break
+            _, proposal = requirement_tracker.requirements[position](state)
             proposed_state = proposal(state)
-            proposal_rating = find_satisfaction(requirement_tracker, proposed_state)
+            proposal_rating, proposal_satisfaction = requirement_tracker.find_satisfaction(proposed_state)
             if proposal_rating > current_satisfaction:
                 state = proposed_state
                 new_satisfaction = proposal_rating
-                update_satisfaction(requirement_tracker, state)
+                requirement_tracker.set_satisfaction(proposal_satisfaction)
                 break
             # if the proposal causes the satisfaction score to go down, reduce how easy the requirement is to satisfy
             if proposal_rating < current_satisfaction:
-                info.ease *= 0.5
-        
+                requirement_tracker.ease[position] *= 0.5
+
         # if the satisfaction rating has not improved, increase the stalemate count
         if current_satisfaction == new_satisfaction:
             stalemate_count += 1
 
-    return state, {info.id: info.satisfaction for info in requirement_tracker}
+    return state, requirement_tracker.to_dict()
+
+def _run_start(requirements: list[Callable[[Any], Tuple[float, Callable[[Any], Any]]]], initial_state: Any, importance: list[int], stalemate_threshold: int, seed: int, deadline: Optional[float]) -> Tuple[Any, dict]:
+    """Runs `apply_requirements` with a seeded random number generator until a deadline. Runs in the worker processes of `multistart_requirements`."""
+    seed_random(seed)
+    time_budget = max(0, deadline - time.time()) if deadline is not None else None
+    return apply_requirements(requirements, initial_state, importance, stalemate_threshold, time_budget, verbose=False)
+
+def _rate(satisfaction: dict, importance: list[int]) -> float:
+    """Gets the satisfaction of a dictionary of requirement satisfactions, weighted by importance."""
+    return sum(satisfaction[position] * importance[position] for position in satisfaction)
+
+def multistart_requirements(requirements: list[Callable[[Any], Tuple[float, Callable[[Any], Any]]]], initial_state: Any, importance: list[int]=None, stalemate_threshold: int=5, starts: int=8, processes: Optional[int]=None, time_budget: Optional[float]=None, seed: int=0) -> Tuple[Any, dict]:
+    """Runs independent, differently seeded `apply_requirements` walks from the initial state on a process pool, and returns the best state found.
+
+    The walks only differ in the random numbers used by the proposals, so the requirements should use the `random` module for their randomness. As soon as a walk satisfies all of the requirements, the walks that haven't started are cancelled, and its result is returned without waiting for the walks that are still running, which finish in the background.
+    The requirements and the state must be picklable, so the requirements can't be lambdas or functions defined inside other functions.
+
+    Parameters
+    ----------
+    requirements : list[Callable[[Any], Tuple[float, Callable[[Any], Any]]]]
+        A list of requirements that apply to the state.
+    initial_state : Any
+        The initial state to apply the requirements to.
+    importance : list[int], optional
+        A list of importance values for the requirements. The default is equal importance.
+    stalemate_threshold : int, optional
+        The stalemate threshold of each walk. The default is 5.
+    starts : int, optional
+        The number of walks. The default is 8.
+    processes : int, optional
+        The number of worker processes. The default is the number of CPUs.
+    time_budget : float, optional
+        The number of seconds after which all walks give up. The default is no limit.
+    seed : int, optional
+        The seed of the first walk. The walks are seeded with consecutive numbers.
+
+    Returns
+    -------
+    Tuple[Any, dict]
+        A tuple of the best state found, i.e. the one with the highest satisfaction weighted by importance, and a dictionary of how well each of the requirements were satisfied. Ties are broken by the seed of the walk.
+    """
+    if importance is None: importance = [1] * len(requirements)
+    deadline = time.time() + time_budget if time_budget is not None else None
+    results = {}
+    executor = ProcessPoolExecutor(processes)
+    stopped_early = False
+    try:
+        futures = {executor.submit(_run_start, requirements, initial_state, importance, stalemate_threshold, seed + start, deadline): start for start in range(starts)}
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[futures[future]] = future.result()
+            if pending and any(all(value >= 1 for value in satisfaction.values()) for _, satisfaction in results.values()):
+                stopped_early = True
+                break
+    finally:
+        # leaving a `with` block would wait for the running walks, so shut down without waiting after an early stop
+        executor.shutdown(wait=not stopped_early, cancel_futures=True)
+    best = max(sorted(results), key=lambda start: _rate(results[start][1], importance))
+    return results[best]
+
+def beam_search_requirements(requirements: list[Callable[[Any], Tuple[float, Callable[[Any], Any]]]], initial_state: Any, importance: list[int]=None, beam_width: int=4, branching: int=8, stalemate_threshold: int=5, max_steps: int=1000, time_budget: Optional[float]=None) -> Tuple[Any, dict]:
+    """Searches for a state that satisfies the requirements by keeping the `beam_width` best states at every step, instead of a single greedy walk.
+
+    At every step, each state in the beam proposes the states suggested by its `branching` highest priority requirements, and the best of all proposed states by satisfaction weighted by importance become the next beam. A state whose proposals are all worse can still lead to a better state later, which lets the search move past states where a greedy walk stalls.
+
+    Parameters
+    ----------
+    requirements : list[Callable[[Any], Tuple[float, Callable[[Any], Any]]]]
+        A list of requirements that apply to the state.
+    initial_state : Any
+        The initial state to apply the requirements to.
+    importance : list[int], optional
+        A list of importance values for the requirements. The default is equal importance.
+    beam_width : int, optional
+        The number of states kept at every step. The default is 4.
+    branching : int, optional
+        The number of requirements that propose a state for each state in the beam. The default is 8.
+    stalemate_threshold : int, optional
+        The number of steps without improving the best state found before giving up. The default is 5.
+    max_steps : int, optional
+        The maximum number of steps. The default is 1000.
+    time_budget : float, optional
+        The number of seconds after which to give up. The default is no limit.
+
+    Returns
+    -------
+    Tuple[Any, dict]
+        A tuple of the best state found and a dictionary of how well each of the requirements were satisfied.
+    """
+    if importance is None: importance = [1] * len(requirements)
+    deadline = time.time() + time_budget if time_budget is not None else None
+    requirement_tracker = RequirementTracker(requirements, importance, np.zeros(len(requirements)))
+    rating, satisfaction = requirement_tracker.find_satisfaction(initial_state)
+    beam = [(rating, initial_state, satisfaction)]
+    best = beam[0]
+    stalemate_count = 0
+    for _ in range(max_steps):
+        if np.all(best[2] >= 1) or stalemate_count >= stalemate_threshold or (deadline is not None and time.time() >= deadline):
+            break
+        candidates = []
+        for _, state, satisfaction in beam:
+            requirement_tracker.set_satisfaction(satisfaction)
+            proposals = 0
+            for position in requirement_tracker.iter_by_priority(branching):
+                if proposals == branching or (deadline is not None and time.time() >= deadline):
+                    break
+                if satisfaction[position] >= 1:
+                    continue
+                _, proposal = requirements[position](state)
+                proposed_state = proposal(state)
+                proposed_rating, proposed_satisfaction = requirement_tracker.find_satisfaction(proposed_state)
+                candidates.append((proposed_rating, proposed_state, proposed_satisfaction))
+                proposals += 1
+        if not candidates:
+            break
+        # keep the best candidates, in order of proposal on ties
+        beam = sorted(candidates, key=lambda candidate: candidate[0], reverse=True)[:beam_width]
+        if beam[0][0] > best[0]:
+            best = beam[0]
+            stalemate_count = 0
+        else:
+            stalemate_count += 1
+    return best[1], dict(enumerate(best[2].tolist()))
 
 def test_apply_requirements():
     """A Test function for `apply_requirements`."""
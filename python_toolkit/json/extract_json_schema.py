@@ -1,4 +1,9 @@
 import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from copy import deepcopy
+from functools import reduce
+from json_stats import JsonStats, sample_array
 
 # Define your input file containing a list of JSON objects
 input_file = 'path/to/your/input_file.jsonl'
@@ -7,20 +12,22 @@ input_file = 'path/to/your/input_file.jsonl'
 output_schema_file = 'json_schema.json'
 
 # Function to update the schema with the data from the given JSON object
-def update_schema_with_object(schema, json_obj):
+def update_schema_with_object(schema, json_obj, array_sample=None):
     for key, value in json_obj.items():
+        # arrays get an item schema from all of their object elements, other arrays are treated as plain values
+        item_objs = [item for item in sample_array(value, array_sample) if isinstance(item, dict)] if isinstance(value, list) else []
         if key not in schema:
             if isinstance(value, dict):
                 schema[key] = {
                     "type": "object",
-                    "properties": update_schema_with_object({}, value)
+                    "properties": update_schema_with_object({}, value, array_sample)
                 }
-            elif isinstance(value, list) and len(value) > 0 and isinstance(value[0], dict):
+            elif item_objs:
                 schema[key] = {
                     "type": "array",
                     "items": {
                         "type": "object",
-                        "properties": update_schema_with_object({}, value[0])
+                        "properties": reduce(lambda properties, item: update_schema_with_object(properties, item, array_sample), item_objs, {})
                     }
                 }
             else:
@@ -29,24 +36,86 @@ def update_schema_with_object(schema, json_obj):
                     "example": value
                 }
         elif schema[key]["type"] == "object" and isinstance(value, dict):
-            schema[key]["properties"] = update_schema_with_object(schema[key]["properties"], value)
-        elif schema[key]["type"] == "array" and isinstance(value, list) and len(value) > 0 and isinstance(value[0], dict):
-            schema[key]["items"]["properties"] = update_schema_with_object(schema[key]["items"]["properties"], value[0])
+            schema[key]["properties"] = update_schema_with_object(schema[key]["properties"], value, array_sample)
+        elif schema[key]["type"] == "array" and item_objs:
+            for item in item_objs:
+                schema[key]["items"]["properties"] = update_schema_with_object(schema[key]["items"]["properties"], item, array_sample)
 
     return schema
 
-# Generate the JSON schema
-def generate_json_schema(input_file):
-    schema = {}
-    with open(input_file, 'r') as file:
-        for line in file:
-            json_obj = json.loads(line.strip())
-            schema = update_schema_with_object(schema, json_obj)
+# Merge the schema inferred from one part of a file into the schema inferred from the part before it
+# - the merge is associative, so partial schemas can be merged in any grouping as long as they stay in file order
+# - as when updating a schema with objects, a key keeps the type it was first seen with, and object and array schemas are merged
+# - the result is the same as inferring the schema of the whole file in one pass, unless a key is seen with conflicting types
+def merge_schemas(schema, other):
+    schema = deepcopy(schema)
+    for key, node in other.items():
+        if key not in schema:
+            schema[key] = deepcopy(node)
+        elif schema[key]["type"] == "object" and node["type"] == "object":
+            schema[key]["properties"] = merge_schemas(schema[key]["properties"], node["properties"])
+        elif schema[key]["type"] == "array" and node["type"] == "array":
+            schema[key]["items"]["properties"] = merge_schemas(schema[key]["items"]["properties"], node["items"]["properties"])
     return schema
 
-# Run the script and generate the JSON schema
-json_schema = generate_json_schema(input_file)
+# Split a file into byte ranges of roughly equal size; each range is later aligned to line boundaries by the worker that reads it
+def split_byte_ranges(input_file, range_count):
+    size = os.path.getsize(input_file)
+    bounds = [size * i // range_count for i in range(range_count + 1)]
+    return [(start, end) for start, end in zip(bounds, bounds[1:]) if start < end]
+
+# Iterate over the JSON objects on all lines that start within a byte range of a file
+def iter_range_objects(input_file, start, end):
+    with open(input_file, 'rb') as file:
+        if start > 0:
+            # a line that starts before the range belongs to the previous range, so skip to the first line starting in this range
+            file.seek(start - 1)
+            file.readline()
+        position = file.tell()
+        while position < end:
+            line = file.readline()
+            if not line:
+                break
+            position += len(line)
+            if line.strip():
+                yield json.loads(line)
+
+# Infer the schema of the objects on the lines in a byte range of a file
+# - with `collect_stats`, per-path statistics of the objects are collected in the same pass, and returned along with the schema
+def infer_range_schema(input_file, start, end, array_sample=None, collect_stats=False):
+    schema = {}
+    stats = JsonStats() if collect_stats else None
+    for json_obj in iter_range_objects(input_file, start, end):
+        schema = update_schema_with_object(schema, json_obj, array_sample)
+        if collect_stats:
+            stats.add(json_obj, array_sample)
+    return (schema, stats) if collect_stats else schema
+
+# Merge the schemas, and statistics if collected, of consecutive byte ranges of a file
+def merge_range_results(result, other):
+    if isinstance(result, tuple):
+        return merge_schemas(result[0], other[0]), result[1].merge(other[1])
+    return merge_schemas(result, other)
+
+# Generate the JSON schema
+# - with `processes` greater than 1, the file is split into byte ranges whose schemas are inferred in parallel worker processes, and merged in file order
+# - with `array_sample`, the item schema of each array is inferred from at most that many of its elements
+# - with `collect_stats`, a `JsonStats` of the file is returned along with the schema, replacing separate passes over the file to profile it
+def generate_json_schema(input_file, processes=None, array_sample=None, ranges_per_process=4, collect_stats=False):
+    if processes is None or processes <= 1:
+        return infer_range_schema(input_file, 0, os.path.getsize(input_file), array_sample, collect_stats)
+    ranges = split_byte_ranges(input_file, processes * ranges_per_process)
+    if not ranges:
+        return ({}, JsonStats()) if collect_stats else {}
+    starts, ends = [start for start, _ in ranges], [end for _, end in ranges]
+    with ProcessPoolExecutor(processes) as executor:
+        results = executor.map(infer_range_schema, [input_file] * len(ranges), starts, ends, [array_sample] * len(ranges), [collect_stats] * len(ranges))
+        return reduce(merge_range_results, results)
+
+if __name__ == '__main__':
+    # Run the script and generate the JSON schema
+    json_schema = generate_json_schema(input_file, processes=os.cpu_count())
 
-# Write the JSON schema to a file
-with open(output_schema_file, 'w') as outfile:
-    json.dump(json_schema, outfile, indent=4)
+    # Write the JSON schema to a file
+    with open(output_schema_file, 'w') as outfile:
+        json.dump(json_schema, outfile, indent=4)
@@ -1,10 +1,168 @@
-from typing import Mapping, Sequence
+from typing import Any, Iterable, Iterator, Mapping, Sequence, Tuple, Union
+import numpy as np
+import pandas as pd
+from json_stats import ARRAY_ELEMENTS
 
 
 def is_flat(json_dict: dict):
     """Check whether a dictionary represents a flat JSON object."""
     for key, value in json_dict.items():
-        if isinstance(value, Mapping, Sequence):
+        if isinstance(value, (Mapping, Sequence)) and not isinstance(value, str):
             return False
     return True
+# test_is_flat = is_flat({'a': 1, 'b': 'text'}), is_flat({'a': [1]})
 
+# Python type names accepted for each type in a schema
+_SCHEMA_TYPES = {'object': 'dict', 'array': 'list'}
+# JSON has a single number type, and numbers are parsed as ints or floats depending on whether they have a fractional part, so ints and floats are valid wherever either is expected. Extracted schemas record the type of the first value seen, so a key first seen as 1 may hold 1.5 later.
+_WIDENED_TYPES = {'float': ('int',), 'int': ('float',)}
+
+VIOLATION_COLUMNS = ['record', 'path', 'violation', 'expected', 'found']
+
+def _accepted_types(schema_type: str) -> frozenset:
+    type_name = _SCHEMA_TYPES.get(schema_type, schema_type)
+    return frozenset((type_name, *_WIDENED_TYPES.get(type_name, ())))
+
+class SchemaValidator:
+    """
+    Validates JSON objects against a schema in the format produced by ``extract_json_schema.py``.
+
+    The schema is compiled once into a table of the types accepted at each key path, and of the keys allowed in each object, so that checking a value is a single dict lookup instead of a walk down the schema.
+    Array elements are checked against the item schema of their array, at paths where '[]' stands for the elements, e.g. ('orders', '[]', 'price'). As in schema extraction, only elements that are objects are checked.
+    Ints and floats are both JSON numbers, so either is valid where the schema has the other.
+
+    Violations are one of:
+    - 'type': a value whose type is not the one in the schema.
+    - 'unexpected': a key that is not in the schema.
+    - 'missing': a key in the schema that is not in an object. Only reported with `required`.
+
+    Parameters
+    ----------
+    schema : dict
+        The schema, as produced by `generate_json_schema`.
+    allow_null : bool, optional
+        Whether null values are valid for any key. Defaults to True.
+    required : bool, optional
+        Whether every key in the schema must be present in every object it could be in. Defaults to False, as extracted schemas hold the union of the keys of all objects.
+    """
+
+    def __init__(self, schema: dict, allow_null: bool=True, required: bool=False):
+        self.allow_null = allow_null
+        self.required = required
+        self.types: 'dict[tuple, frozenset]' = {}
+        self.keys: 'dict[tuple, frozenset]' = {}
+        self.array_paths: 'set[tuple]' = set()
+        self._compile(schema, ())
+
+    def _compile(self, properties: dict, path: tuple):
+        self.keys[path] = frozenset(properties)
+        for key, node in properties.items():
+            child = (*path, key)
+            self.types[child] = _accepted_types(node['type'])
+            if node['type'] == 'object':
+                self._compile(node['properties'], child)
+            elif node['type'] == 'array':
+                self.array_paths.add(child)
+                self.types[(*child, ARRAY_ELEMENTS)] = _accepted_types('object')
+                self._compile(node['items']['properties'], (*child, ARRAY_ELEMENTS))
+
+    def iter_violations(self, json_obj: dict) -> 'Iterator[Tuple[tuple, str, Union[frozenset, None], Union[str, None]]]':
+        """Iterate over the violations in an object, as tuples of the path, the kind of violation, the accepted type names and the found type name."""
+        types, keys, array_paths, allow_null, required = self.types, self.keys, self.array_paths, self.allow_null, self.required
+        stack = [((), json_obj)]
+        while stack:
+            path, obj = stack.pop()
+            for key, value in obj.items():
+                child = (*path, key)
+                type_name = type(value).__name__
+                accepted = types.get(child)
+                if accepted is None:
+                    yield child, 'unexpected', None, type_name
+                elif type_name not in accepted:
+                    if value is not None or not allow_null:
+                        yield child, 'type', accepted, type_name
+                elif type_name == 'dict':
+                    stack.append((child, value))
+                elif type_name == 'list' and child in array_paths:
+                    items = (*child, ARRAY_ELEMENTS)
+                    stack.extend((items, item) for item in value if isinstance(item, dict))
+            if required:
+                for key in keys[path].difference(obj):
+                    yield (*path, key), 'missing', types[(*path, key)], None
+
+    def is_valid(self, json_obj: dict) -> bool:
+        """Check whether an object has no violations, stopping at the first one."""
+        return next(self.iter_violations(json_obj), None) is None
+
+    def validate_batch(self, records: 'Iterable[dict]', sep: str='.') -> pd.DataFrame:
+        """Validate a batch of objects, and get a dataframe with one row per violation.
+
+        Parameters
+        ----------
+        records : Iterable[dict]
+            The objects to validate.
+        sep : str, optional
+            The separator used to join the elements of paths. Defaults to '.'.
+
+        Returns
+        -------
+        DataFrame
+            The position of the object in the batch ('record'), the path of the violation, the kind of violation, the accepted type names joined by '|' ('expected') and the found type name, for each violation.
+        """
+        columns = {column: [] for column in VIOLATION_COLUMNS}
+        record_column, path_column, violation_column, expected_column, found_column = columns.values()
+        for position, json_obj in enumerate(records):
+            for path, violation, accepted, found in self.iter_violations(json_obj):
+                record_column.append(position)
+                path_column.append(sep.join(path))
+                violation_column.append(violation)
+                expected_column.append('|'.join(sorted(accepted)) if accepted is not None else None)
+                found_column.append(found)
+        return pd.DataFrame(columns)
+
+    def validate_frame(self, frame: pd.DataFrame, sep: str='.') -> pd.DataFrame:
+        """Validate flat records loaded into a dataframe, checking whole columns at once instead of one value at a time.
+        - Columns are matched to the paths of the schema that are not objects or arrays, or inside arrays, joined by `sep`, as done by `mappings.flatten_records`.
+        - Missing values are treated as nulls, and missing columns as missing keys.
+        - The types of numeric and boolean columns are found from their dtype. Floats without a fractional part are treated as ints, since a pandas column of ints with missing values is stored as floats.
+
+        Returns
+        -------
+        DataFrame
+            The violations, in the format returned by `validate_batch`, with the index label of each row as its 'record'.
+        """
+        leaf_types = {sep.join(path): accepted for path, accepted in self.types.items() if path not in self.keys and path not in self.array_paths and ARRAY_ELEMENTS not in path}
+        violations = []
+        def _add(mask: 'Union[np.ndarray, pd.Series]', path: str, violation: str, accepted: 'Union[frozenset, None]', found: Any):
+            mask = np.asarray(mask, dtype=bool)
+            if mask.any():
+                violations.append(pd.DataFrame({
+                    'record': frame.index[mask], 'path': path, 'violation': violation,
+                    'expected': '|'.join(sorted(accepted)) if accepted is not None else None,
+                    'found': found[mask] if isinstance(found, np.ndarray) else found,
+                }))
+        for column in frame.columns:
+            series = frame[column]
+            is_null = series.isna().to_numpy()
+            kind = series.dtype.kind
+            if kind in 'iu':
+                found = np.full(len(series), 'int', dtype=object)
+            elif kind == 'f':
+                found = np.where(series.to_numpy() % 1 == 0, 'int', 'float').astype(object)
+            elif kind == 'b':
+                found = np.full(len(series), 'bool', dtype=object)
+            else:
+                found = series.map(lambda value: type(value).__name__).to_numpy(dtype=object)
+            accepted = leaf_types.get(column)
+            if accepted is None:
+                _add(~is_null, column, 'unexpected', None, found)
+                continue
+            _add(~is_null & ~np.isin(found, list(accepted)), column, 'type', accepted, found)
+            if not self.allow_null and 'NoneType' not in accepted:
+                _add(is_null, column, 'type', accepted, 'NoneType')
+        if self.required:
+            for path in leaf_types.keys() - set(frame.columns):
+                _add(np.ones(len(frame), dtype=bool), path, 'missing', leaf_types[path], None)
+        if not violations:
+            return pd.DataFrame(columns=VIOLATION_COLUMNS)
+        return pd.concat(violations, ignore_index=True)
@@ -1,4 +1,63 @@
-from typing import Any, Union, Callable
+from itertools import islice
+from typing import Any, Hashable, Iterable, Iterator, Union, Callable
+from json_stream import STRUCTURE_EVENTS
+
+def iter_search_for_value(data: Union[dict, list], is_value: 'Callable[[Any], bool]', max_results: 'Union[int, None]'=None) -> 'Iterator[list[str]]':
+    """Lazily finds paths to values that match the given value, in the same order as `search_for_value`.
+    The data is walked with an explicit stack, and each path is yielded as soon as it is found, so the search can be stopped early without walking the rest of the data.
+
+    Parameters
+    ----------
+    data : Union[dict, list]
+        The data to search through.
+    is_value : 'Callable[[Any], bool]'
+        A filter function that determines whether a particular value's path will be returned.
+    max_results : int, optional
+        The maximum number of paths to yield.
+
+    Yields
+    ------
+    list[str]
+        A path to a value that matches the given value.
+    """
+    def _search() -> 'Iterator[list[str]]':
+        stack = [([], data)]
+        while stack:
+            path, val = stack.pop()
+            if isinstance(val, dict):
+                # push children in reverse, so that they are popped in order
+                stack.extend((path + [key], child) for key, child in reversed(list(val.items())))
+            elif isinstance(val, list):
+                stack.extend((path + [str(i)], child) for i, child in reversed(list(enumerate(val))))
+            elif is_value(val):
+                yield path
+    return islice(_search(), max_results)
+# test_iter_search_for_value = next(iter_search_for_value([{'a': 1, 'b': {'c': 2, 'd': {'e': 3}}}, {'c': 3}], lambda x: x == 3))
+
+def iter_search_events(events: 'Iterable[tuple]', is_value: 'Callable[[Any], bool]', max_results: 'Union[int, None]'=None) -> 'Iterator[list[str]]':
+    """Lazily finds paths to values that match the given value in a stream of parse events, such as the one produced by `json_stream.iter_events`.
+    The paths are the same, and in the same order, as `iter_search_for_value` on the parsed document, but the document is never built, so documents that don't fit in memory can be searched.
+
+    Parameters
+    ----------
+    events : Iterable[tuple]
+        The parse events of the data to search through, as (path, event, value) tuples.
+    is_value : 'Callable[[Any], bool]'
+        A filter function that determines whether a particular value's path will be returned.
+    max_results : int, optional
+        The maximum number of paths to yield. The events after the last result are not consumed.
+
+    Yields
+    ------
+    list[str]
+        A path to a value that matches the given value.
+    """
+    def _search() -> 'Iterator[list[str]]':
+        for path, event, value, *_ in events:
+            if event not in STRUCTURE_EVENTS and is_value(value):
+                yield [str(key) for key in path]
+    return islice(_search(), max_results)
+# test_iter_search_events = next(iter_search_events([((), 'start_array', None), ((0,), 'number', 3), ((), 'end_array', None)], lambda x: x == 3))
 
 def search_for_value(data: Union[dict, list], is_value: 'Callable[[Any], bool]') -> 'list[list[str]]':
     """Recursively finds paths to values that match the given value.
@@ -15,14 +74,71 @@ def search_for_value(data: Union[dict, list], is_value: 'Callable[[Any], bool]')
     list[list[str]]
         A list of paths to values that match the given value.
     """
-    if isinstance(data, dict):
-        return [[key] + path for key, val in data.items() for path in search_for_value(val, is_value)]
-    elif isinstance(data, list):
-        return [[str(i)] + path for i, val in enumerate(data) for path in search_for_value(val, is_value)]
-    else:
-        return [[]] if is_value(data) else []
+    return list(iter_search_for_value(data, is_value))
 # test_search_for_value = search_for_value([{'a': 1, 'b': {'c': 2, 'd': {'e': 3, 'f': {'g': 4, 'h': {'i': 5, 'j': 6}}}}}, {'c': 3}], lambda x: x == 3)
 
+class JsonValueIndex:
+    """
+    An index of all leaf values in a JSON document, for answering repeated searches without walking the document again.
+
+    The document is walked once, and the paths of its values are stored in document order, in a hash index from each distinct value (and its type) to the paths where it occurs. Looking up a value is a single hash lookup, and a search with a filter function calls the function once per distinct value rather than once per occurrence.
+
+    Parameters
+    ----------
+    data : Union[dict, list]
+        The document to index.
+    """
+
+    def __init__(self, data: Union[dict, list]):
+        self.paths: 'list[list[str]]' = []
+        self._positions: 'dict[tuple[type, Hashable], list[int]]' = {}
+        self._unhashable: 'list[tuple[Any, int]]' = []
+        for path in iter_search_for_value(data, lambda val: self._add(val)):
+            self.paths.append(path)
+
+    def _add(self, val: Any) -> bool:
+        """Record the position of a leaf value; the walk then appends its path at that position."""
+        position = len(self.paths)
+        try:
+            self._positions.setdefault((type(val), val), []).append(position)
+        except TypeError:
+            self._unhashable.append((val, position))
+        return True
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({len(self.paths)} values, {len(self._positions)} distinct)"
+
+    def find(self, value: Any) -> 'list[list[str]]':
+        """Find the paths to values that are equal to, and of the same type as, the given value."""
+        try:
+            positions = self._positions.get((type(value), value), [])
+        except TypeError:
+            positions = [position for val, position in self._unhashable if val == value]
+        return [self.paths[position] for position in positions]
+
+    def search(self, is_value: 'Callable[[Any], bool]', max_results: 'Union[int, None]'=None) -> 'list[list[str]]':
+        """Find the paths to values that match the given filter function, in document order.
+
+        Parameters
+        ----------
+        is_value : 'Callable[[Any], bool]'
+            A filter function that determines whether a particular value's path will be returned.
+        max_results : int, optional
+            The maximum number of paths to return.
+
+        Returns
+        -------
+        list[list[str]]
+            A list of paths to values that match the given value.
+        """
+        positions = [position for (_, val), val_positions in self._positions.items() if is_value(val) for position in val_positions]
+        positions += [position for val, position in self._unhashable if is_value(val)]
+        return [self.paths[position] for position in sorted(positions)[:max_results]]
+# test_json_value_index = JsonValueIndex([{'a': 1, 'b': {'c': 2, 'd': {'e': 3}}}, {'c': 3}]).find(3)
+
 def get_result_paths(paths: 'list[list[str]]', sep: str='.') -> 'list[str]':
     """Converts search result paths from the `search_for_value` function to a list of strings.
 
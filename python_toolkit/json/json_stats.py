@@ -0,0 +1,253 @@
+"""
+Mergeable per-path statistics of JSON records, collected in a single streaming pass.
+
+`JsonStats` collects, for every key path in a stream of JSON objects, the number of times the path is present, missing and null, a histogram of value types, the min/max of numbers and of string lengths, an approximate number of distinct values (with a `HyperLogLog` sketch), and a bounded random sample of example values (with a `Reservoir`).
+All statistics can be merged, so that statistics collected over separate parts of a file in parallel can be combined into the statistics of the whole file.
+
+Paths are tuples of keys, where '[]' stands for the elements of an array, e.g. ('orders', '[]', 'price').
+"""
+
+import hashlib
+import math
+from random import Random
+from typing import Any, Iterator, Tuple, Union
+import pandas as pd
+
+ARRAY_ELEMENTS = '[]'
+
+def sample_array(value: list, array_sample: 'Union[int, None]'=None) -> list:
+    """Pick the elements of an array to look at: all of them, or at most `array_sample` elements spread evenly across the array."""
+    if array_sample is None or len(value) <= array_sample:
+        return value
+    step = len(value) / array_sample
+    return [value[int(i * step)] for i in range(array_sample)]
+# test_sample_array = sample_array(list(range(10)), 3)
+
+class HyperLogLog:
+    """
+    A HyperLogLog sketch for estimating the number of distinct values in a stream, using a fixed amount of memory.
+
+    Values are hashed by their type and `repr`, so that sketches built in separate processes can be merged.
+
+    Parameters
+    ----------
+    precision : int, optional
+        The number of hash bits used to pick a register. The sketch uses 2**precision bytes, and its relative error is about 1.04 / sqrt(2**precision). Defaults to 12 (4 KiB, about 1.6% error).
+    """
+
+    def __init__(self, precision: int=12):
+        self.precision = precision
+        self.registers = bytearray(2 ** precision)
+
+    def add(self, value: Any):
+        """Add a value to the sketch."""
+        digest = hashlib.blake2b(f"{type(value).__name__}:{value!r}".encode('utf-8'), digest_size=8).digest()
+        hashed = int.from_bytes(digest, 'big')
+        register = hashed >> (64 - self.precision)
+        remaining = hashed & ((1 << (64 - self.precision)) - 1)
+        # the rank is the position of the first 1 bit in the remaining bits
+        rank = (64 - self.precision) - remaining.bit_length() + 1
+        if rank > self.registers[register]:
+            self.registers[register] = rank
+
+    def merge(self, other: 'HyperLogLog') -> 'HyperLogLog':
+        """Merge another sketch with the same precision into this one."""
+        if other.precision != self.precision:
+            raise ValueError(f"Cannot merge sketches with precisions {self.precision} and {other.precision}")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def estimate(self) -> float:
+        """Estimate the number of distinct values added to the sketch."""
+        register_count = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / register_count)
+        raw_estimate = alpha * register_count ** 2 / sum(2.0 ** -rank for rank in self.registers)
+        empty_registers = self.registers.count(0)
+        if raw_estimate <= 2.5 * register_count and empty_registers:
+            # linear counting is more accurate for small numbers of distinct values
+            return register_count * math.log(register_count / empty_registers)
+        return raw_estimate
+
+class Reservoir:
+    """
+    A bounded, uniformly random sample of the values in a stream.
+
+    Parameters
+    ----------
+    size : int, optional
+        The maximum number of values to keep. Defaults to 5.
+    seed : int, optional
+        The seed for the random number generator.
+
+    Attributes
+    ----------
+    seen : int
+        The number of values that have been offered to the reservoir.
+    values : list
+        The sampled values.
+    """
+
+    def __init__(self, size: int=5, seed: 'Union[int, None]'=None):
+        self.size = size
+        self.seen = 0
+        self.values = []
+        self._rng = Random(seed)
+
+    def add(self, value: Any):
+        """Offer a value to the reservoir."""
+        self.seen += 1
+        if len(self.values) < self.size:
+            self.values.append(value)
+        else:
+            position = self._rng.randrange(self.seen)
+            if position < self.size:
+                self.values[position] = value
+
+    def merge(self, other: 'Reservoir') -> 'Reservoir':
+        """Merge another reservoir into this one, drawing from each in proportion to the number of values it has seen."""
+        mine, theirs = list(self.values), list(other.values)
+        self._rng.shuffle(mine)
+        self._rng.shuffle(theirs)
+        share = self.seen / (self.seen + other.seen) if self.seen + other.seen else 0
+        values = []
+        while len(values) < self.size and (mine or theirs):
+            values.append(mine.pop() if mine and (not theirs or self._rng.random() < share) else theirs.pop())
+        self.values = values
+        self.seen += other.seen
+        return self
+
+class PathStats:
+    """
+    Statistics of the values at a single key path.
+
+    Parameters
+    ----------
+    example_count : int, optional
+        The number of example values to keep. Defaults to 5.
+    precision : int, optional
+        The precision of the distinct count sketch. See `HyperLogLog`.
+    seed : int, optional
+        The seed for sampling example values.
+    """
+
+    def __init__(self, example_count: int=5, precision: int=12, seed: 'Union[int, None]'=None):
+        self.count = 0
+        self.null_count = 0
+        self.type_counts: 'dict[str, int]' = {}
+        self.min = None
+        self.max = None
+        self.min_length = None
+        self.max_length = None
+        self.distinct = HyperLogLog(precision)
+        self.examples = Reservoir(example_count, seed)
+
+    def add(self, value: Any):
+        """Add a value found at the path."""
+        self.count += 1
+        type_name = type(value).__name__
+        self.type_counts[type_name] = self.type_counts.get(type_name, 0) + 1
+        if value is None:
+            self.null_count += 1
+            return
+        if isinstance(value, (dict, list)):
+            return
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            self.min = value if self.min is None else min(self.min, value)
+            self.max = value if self.max is None else max(self.max, value)
+        elif isinstance(value, str):
+            self.min_length = len(value) if self.min_length is None else min(self.min_length, len(value))
+            self.max_length = len(value) if self.max_length is None else max(self.max_length, len(value))
+        self.distinct.add(value)
+        self.examples.add(value)
+
+    def merge(self, other: 'PathStats') -> 'PathStats':
+        """Merge the statistics of the same path from another part of the data into these ones."""
+        self.count += other.count
+        self.null_count += other.null_count
+        for type_name, count in other.type_counts.items():
+            self.type_counts[type_name] = self.type_counts.get(type_name, 0) + count
+        for attribute, pick in (('min', min), ('max', max), ('min_length', min), ('max_length', max)):
+            values = [value for value in (getattr(self, attribute), getattr(other, attribute)) if value is not None]
+            setattr(self, attribute, pick(values) if values else None)
+        self.distinct.merge(other.distinct)
+        self.examples.merge(other.examples)
+        return self
+
+class JsonStats:
+    """
+    Per-path statistics of a stream of JSON objects.
+
+    Parameters
+    ----------
+    example_count : int, optional
+        The number of example values to keep per path. Defaults to 5.
+    precision : int, optional
+        The precision of the distinct count sketch of each path. See `HyperLogLog`.
+    seed : int, optional
+        The seed for sampling example values.
+
+    Attributes
+    ----------
+    record_count : int
+        The number of objects added.
+    paths : dict[tuple, PathStats]
+        The statistics of each path, in order of first appearance.
+    """
+
+    def __init__(self, example_count: int=5, precision: int=12, seed: 'Union[int, None]'=None):
+        self.example_count = example_count
+        self.precision = precision
+        self.seed = seed
+        self.record_count = 0
+        self.paths: 'dict[tuple, PathStats]' = {}
+
+    def _iter_values(self, json_obj: dict, array_sample: 'Union[int, None]') -> 'Iterator[Tuple[tuple, Any]]':
+        """Iterate over the paths and values of all values nested in an object, depth first."""
+        stack = [((key,), value) for key, value in reversed(list(json_obj.items()))]
+        while stack:
+            path, value = stack.pop()
+            yield path, value
+            if isinstance(value, dict):
+                stack.extend(((*path, key), child) for key, child in reversed(list(value.items())))
+            elif isinstance(value, list):
+                stack.extend(((*path, ARRAY_ELEMENTS), item) for item in reversed(sample_array(value, array_sample)))
+
+    def add(self, json_obj: dict, array_sample: 'Union[int, None]'=None):
+        """Add the values of an object to the statistics. With `array_sample`, at most that many elements of each array are added."""
+        self.record_count += 1
+        for path, value in self._iter_values(json_obj, array_sample):
+            path_stats = self.paths.get(path)
+            if path_stats is None:
+                path_stats = self.paths[path] = PathStats(self.example_count, self.precision, self.seed)
+            path_stats.add(value)
+
+    def merge(self, other: 'JsonStats') -> 'JsonStats':
+        """Merge the statistics of another part of the data into these ones."""
+        self.record_count += other.record_count
+        for path, path_stats in other.paths.items():
+            if path in self.paths:
+                self.paths[path].merge(path_stats)
+            else:
+                self.paths[path] = path_stats
+        return self
+
+    def missing_count(self, path: tuple) -> int:
+        """The number of objects that the path could have been in, but wasn't. For a key in an object, that is the number of times the parent path held an object."""
+        parent = self.paths.get(path[:-1])
+        if len(path) == 1:
+            parent_count = self.record_count
+        elif path[-1] == ARRAY_ELEMENTS:
+            return 0
+        else:
+            parent_count = parent.type_counts.get('dict', 0) if parent is not None else 0
+        return parent_count - self.paths[path].count if path in self.paths else parent_count
+
+    def summary(self, sep: str='.') -> pd.DataFrame:
+        """Get a dataframe with one row of statistics per path, with the path elements joined by `sep`."""
+        rows = []
+        for path, path_stats in self.paths.items():
+            rows.append([
+                sep.join(map(str, path)), path_stats.count, self.missing_count(path), path_stats.null_count, dict(path_stats.type_counts),
+                path_stats.min, path_stats.max, path_stats.min_length, path_stats.max_length, round(path_stats.distinct.estimate()), list(path_stats.examples.values),
+            ])
+        return pd.DataFrame(rows, columns=['path', 'count', 'missing', 'nulls', 'types', 'min', 'max', 'min_length', 'max_length', 'distinct', 'examples'])
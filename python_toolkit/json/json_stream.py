@@ -0,0 +1,231 @@
+"""
+Incremental parsing of JSON documents that are too large to be loaded into memory, such as exports that are a single multi-GB array.
+
+`iter_events` reads a document in blocks and yields a flat stream of parse events, in the style of ijson: the path of the value, the kind of event, and the value of scalars and keys. Only the current block and the current path are kept in memory, so memory is proportional to the nesting depth and the largest single token, not to the size of the document.
+The events can be consumed by `flatten_events`, `json_search.iter_search_events` and `build_at`, and `iter_array_spans` finds the byte spans of the elements of an array, e.g. for `lineage_tracer_streaming.JsonArrayLookup`.
+
+Blocks are decoded as latin-1, so that every character is a single byte and positions in the text are byte offsets in the file. Strings are decoded as UTF-8 once they have been found.
+"""
+
+import io
+import re
+from json.decoder import scanstring
+from json.scanner import NUMBER_RE
+from pathlib import Path
+from typing import Any, BinaryIO, Iterable, Iterator, Tuple, Union
+
+# Events that start and end containers
+START_EVENTS = {'start_map': dict, 'start_array': list}
+END_EVENTS = {'end_map', 'end_array'}
+# Events that don't hold a value: the start and end of containers, and object keys
+STRUCTURE_EVENTS = frozenset((*START_EVENTS, *END_EVENTS, 'map_key'))
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+# a number can only be parsed once a character that can't be part of it has been read
+_NUMBER_END = re.compile(r'[^0-9.eE+\-]')
+_LITERALS = {'t': ('true', 'boolean', True), 'f': ('false', 'boolean', False), 'n': ('null', 'null', None)}
+
+def _iter_tokens(file: BinaryIO, buffer_size: int) -> 'Iterator[Tuple[str, Any, int, int]]':
+    """Iterate over the tokens of a JSON document as tuples of the kind of token, its value, and its start and end byte offsets."""
+    text, pos, offset, eof = '', 0, 0, False
+    while True:
+        pos = _WHITESPACE.match(text, pos).end()
+        if pos == len(text) or (not eof and len(text) - pos < 8):
+            if eof:
+                if pos == len(text):
+                    return
+            else:
+                # drop the consumed text, and read the next block
+                block = file.read(buffer_size)
+                eof = not block
+                text, offset, pos = text[pos:] + block.decode('latin-1'), offset + pos, 0
+                continue
+        char = text[pos]
+        if char in '{}[]:,':
+            yield char, None, offset + pos, offset + pos + 1
+            pos += 1
+        elif char == '"':
+            try:
+                value, end = scanstring(text, pos + 1, True)
+            except ValueError:
+                if eof:
+                    raise
+                # the string continues in the next block
+                block = file.read(buffer_size)
+                eof = not block
+                text, offset, pos = text[pos:] + block.decode('latin-1'), offset + pos, 0
+                continue
+            raw = text[pos + 1:end - 1]
+            if '\\' in raw:
+                # escapes may stand for characters that are not in latin-1, so decode the raw bytes first
+                value = scanstring(raw.encode('latin-1').decode('utf-8') + '"', 0, True)[0]
+            else:
+                value = raw.encode('latin-1').decode('utf-8')
+            yield 'string', value, offset + pos, offset + end
+            pos = end
+        elif char in _LITERALS:
+            literal, kind, value = _LITERALS[char]
+            if not text.startswith(literal, pos):
+                raise ValueError(f"Invalid literal at byte {offset + pos}: {text[pos:pos + len(literal)]!r}")
+            yield kind, value, offset + pos, offset + pos + len(literal)
+            pos += len(literal)
+        else:
+            match = NUMBER_RE.match(text, pos)
+            if match is None:
+                raise ValueError(f"Unexpected character at byte {offset + pos}: {char!r}")
+            if not eof and _NUMBER_END.search(text, pos) is None:
+                block = file.read(buffer_size)
+                eof = not block
+                text, offset, pos = text[pos:] + block.decode('latin-1'), offset + pos, 0
+                continue
+            integer, fraction, exponent = match.groups()
+            value = float(integer + (fraction or '') + (exponent or '')) if fraction or exponent else int(integer)
+            yield 'number', value, offset + pos, offset + match.end()
+            pos = match.end()
+
+def _iter_events(file: BinaryIO, buffer_size: int) -> 'Iterator[Tuple[tuple, str, Any, int, int]]':
+    """Iterate over the parse events of a JSON document, with the start and end byte offsets of the token of each event."""
+    path = []
+    containers = []
+    # what the next token can be: 'value', 'value_or_end' (after '['), 'key_or_end' (after '{'), 'key', 'colon', 'comma_or_end' or 'done'
+    state = 'value'
+    for kind, value, start, end in _iter_tokens(file, buffer_size):
+        if state == 'colon':
+            if kind != ':':
+                raise ValueError(f"Expected ':' at byte {start}")
+            state = 'value'
+            continue
+        if state == 'comma_or_end' and kind == ',':
+            if containers[-1] == '[':
+                path[-1] += 1
+                state = 'value'
+            else:
+                path.pop()
+                state = 'key'
+            continue
+        if (kind == '}' and state in ('key_or_end', 'comma_or_end') and containers[-1] == '{') or (kind == ']' and state in ('value_or_end', 'comma_or_end') and containers[-1] == '['):
+            if state == 'comma_or_end' or kind == ']':
+                path.pop()
+            containers.pop()
+            yield tuple(path), 'end_map' if kind == '}' else 'end_array', None, start, end
+        elif state in ('key', 'key_or_end'):
+            if kind != 'string':
+                raise ValueError(f"Expected a key at byte {start}")
+            yield tuple(path), 'map_key', value, start, end
+            path.append(value)
+            state = 'colon'
+            continue
+        elif state in ('value', 'value_or_end'):
+            if kind == '{':
+                yield tuple(path), 'start_map', None, start, end
+                containers.append('{')
+                state = 'key_or_end'
+                continue
+            if kind == '[':
+                yield tuple(path), 'start_array', None, start, end
+                containers.append('[')
+                path.append(0)
+                state = 'value_or_end'
+                continue
+            if kind in ',:]}':
+                raise ValueError(f"Expected a value at byte {start}")
+            yield tuple(path), kind, value, start, end
+        else:
+            raise ValueError(f"Unexpected {kind!r} at byte {start}" if state != 'done' else f"Extra data at byte {start}")
+        state = 'comma_or_end' if containers else 'done'
+    if state != 'done':
+        raise ValueError('Unexpected end of document')
+
+def _open(source: 'Union[str, Path, bytes, BinaryIO]') -> BinaryIO:
+    if isinstance(source, bytes):
+        return io.BytesIO(source)
+    return open(source, 'rb') if isinstance(source, (str, Path)) else source
+
+def iter_events(source: 'Union[str, Path, bytes, BinaryIO]', buffer_size: int=2**20, with_offsets: bool=False) -> 'Iterator[tuple]':
+    """
+    Incrementally parse a JSON document into a stream of events.
+
+    Each event is a tuple of:
+    - the path of the value that the event belongs to, as a tuple of object keys and array positions.
+    - the kind of event: 'start_map', 'map_key', 'end_map', 'start_array', 'end_array', or the type of a scalar: 'string', 'number', 'boolean' or 'null'.
+    - the key for 'map_key' events, the value for scalars, and None otherwise.
+    The path of a 'map_key' event is the path of its object, not of the key's value.
+
+    Parameters
+    ----------
+    source : Union[str, Path, bytes, BinaryIO]
+        The path to the document, a file opened in binary mode, or the document itself as bytes.
+    buffer_size : int, optional
+        The number of bytes read at a time. Defaults to 1 MiB.
+    with_offsets : bool, optional
+        Whether to add the start and end byte offsets of the token of each event to the event tuples.
+
+    Yields
+    ------
+    tuple
+        The (path, event, value) of each event, or (path, event, value, start, end) with `with_offsets`.
+
+    >>> list(iter_events(b'{"a": [1, "x"]}'))
+    [((), 'start_map', None), ((), 'map_key', 'a'), (('a',), 'start_array', None), (('a', 0), 'number', 1), (('a', 1), 'string', 'x'), (('a',), 'end_array', None), ((), 'end_map', None)]
+    """
+    file = _open(source)
+    try:
+        if with_offsets:
+            yield from _iter_events(file, buffer_size)
+        else:
+            for path, event, value, _, _ in _iter_events(file, buffer_size):
+                yield path, event, value
+    finally:
+        if file is not source:
+            file.close()
+
+def flatten_events(events: 'Iterable[tuple]') -> 'Iterator[Tuple[tuple, Any]]':
+    """
+    Iterate over the (key path, value) pairs of all leaf values in a stream of parse events, such as the one produced by `iter_events` (or ijson, with paths as tuples).
+
+    The pairs are the same, and in the same order, as `mappings.iter_flatten` on the parsed document, but the document is never built, so documents that don't fit in memory can be flattened.
+
+    >>> list(flatten_events([((), 'start_map', None), ((), 'map_key', 'a'), (('a',), 'number', 3), ((), 'end_map', None)]))
+    [(('a',), 3)]
+    """
+    for path, event, value, *_ in events:
+        if event not in STRUCTURE_EVENTS:
+            yield path, value
+
+def build_at(events: 'Iterable[tuple]', path: tuple=()) -> 'Iterator[Any]':
+    """Build the values whose path starts with `path`, followed by a single array position, from a stream of events. E.g. with the path of an array, its elements are built one at a time, so that an array that doesn't fit in memory can be processed element by element."""
+    depth = len(path) + 1
+    stack = []
+    for event_path, event, value, *_ in events:
+        if len(event_path) < depth or event_path[:depth - 1] != path:
+            continue
+        if event in START_EVENTS:
+            stack.append((event_path, START_EVENTS[event]()))
+            continue
+        if event == 'map_key':
+            continue
+        if event in END_EVENTS:
+            event_path, value = stack.pop()
+        if stack:
+            container = stack[-1][1]
+            if isinstance(container, dict):
+                container[event_path[-1]] = value
+            else:
+                container.append(value)
+        else:
+            yield value
+# test_build_at = list(build_at(iter_events(b'{"rows": [{"a": 1}, {"a": [2]}]}'), ('rows',)))
+
+def iter_array_spans(source: 'Union[str, Path, bytes, BinaryIO]', path: tuple=(), buffer_size: int=2**20) -> 'Iterator[Tuple[int, int]]':
+    """Find the start and end byte offsets of the elements of the array at `path` in a JSON document, without building any values. The bytes of each span can be parsed on their own with `json.loads`."""
+    depth = len(path) + 1
+    start = None
+    for event_path, event, _, token_start, token_end in iter_events(source, buffer_size, with_offsets=True):
+        if len(event_path) != depth or event_path[:-1] != path or event == 'map_key':
+            continue
+        if start is None:
+            start = token_start
+        if event not in START_EVENTS:
+            yield start, token_end
+            start = None
+# test_iter_array_spans = list(iter_array_spans(b'[{"a": 1}, 2, [3]]'))
@@ -0,0 +1,184 @@
+"""
+Random access to the records of large JSONL files.
+
+`JsonlStore` memory-maps a JSONL file and indexes the byte offsets of its lines once, saving the index next to the file so that later runs can skip the scan. Records can then be read by number, sliced, iterated over, or processed in chunks by parallel worker processes, and only the records that are touched are parsed.
+
+Records are parsed with orjson when it is installed, and with the standard library's `json` otherwise. Any other decoder that accepts bytes, such as `ujson.loads`, can be passed instead.
+`lineage_tracer_streaming.JsonlLookup` and `JsonArrayLookup` are built on `JsonlStore`, to serve the records of a file as a `lookup` dataset for `trace`.
+"""
+
+import json
+import mmap
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Iterator, List, Tuple, Union
+import numpy as np
+
+try:
+    import orjson
+    default_decoder = orjson.loads
+except ImportError:
+    default_decoder = json.loads
+
+# saved indexes of another version were built with other rules for which lines are records, and are rebuilt
+_INDEX_VERSION = 2
+
+# the bytes removed by `bytes.strip`, other than the newlines that lines are split on
+_WHITESPACE_BYTES = np.frombuffer(b' \t\r\x0b\x0c', dtype=np.uint8)
+
+def find_line_offsets(buffer: Union[bytes, mmap.mmap], block_size: int=64 * 2**20) -> 'Tuple[np.ndarray, np.ndarray]':
+    """Find the start and end byte offsets of all non-empty lines in a buffer, scanning it for newlines one block at a time. Lines that only hold whitespace count as empty, as they do for `bytes.strip`, so that records are numbered as in `lineage_tracer_streaming.JsonlTarget`."""
+    newlines = []
+    for block_start in range(0, len(buffer), block_size):
+        block = np.frombuffer(buffer[block_start:block_start + block_size], dtype=np.uint8)
+        newlines.append(np.flatnonzero(block == ord('\n')) + block_start)
+    ends = np.concatenate(newlines + [np.array([len(buffer)])]).astype(np.int64)
+    starts = np.concatenate([[0], ends[:-1] + 1]).astype(np.int64)
+    # skip empty lines, including the one after a trailing newline, and whitespace-only lines such as a lone carriage return
+    lengths = ends - starts
+    is_empty = lengths == 0
+    # only lines that start with whitespace can be whitespace-only, and JSON records rarely do, so those are the only lines checked one by one
+    positions = np.flatnonzero(~is_empty)
+    first_bytes = np.frombuffer(buffer, dtype=np.uint8)[starts[positions]]
+    for position in positions[np.isin(first_bytes, _WHITESPACE_BYTES)]:
+        is_empty[position] = not buffer[starts[position]:ends[position]].strip()
+    return starts[~is_empty], ends[~is_empty]
+# test_find_line_offsets = find_line_offsets(b'{"a": 1}\n\n{"a": 2}\n')
+
+def _decode_span(path: 'Union[str, Path]', starts: np.ndarray, ends: np.ndarray, decoder: 'Callable[[bytes], Any]', func: 'Union[Callable[[List[Any]], Any], None]') -> Any:
+    """Parse the records between the given offsets of a file, and apply `func` to them. Runs in a worker process of `JsonlStore.map_chunks`."""
+    if not len(starts):
+        records = []
+    else:
+        with open(path, 'rb') as file:
+            file.seek(int(starts[0]))
+            span = file.read(int(ends[-1] - starts[0]))
+        offset = starts[0]
+        records = [decoder(span[start - offset:end - offset]) for start, end in zip(starts, ends)]
+    return func(records) if func is not None else records
+
+class JsonlStore:
+    """
+    A memory-mapped JSONL file with an index of the byte offsets of its records. Record numbers count the lines of the file that aren't empty or whitespace-only, as `lineage_tracer_streaming.JsonlTarget` does.
+
+    A saved index is rebuilt if the file's size or modification time has changed, or if it was saved with an older version of the index format.
+
+    Parameters
+    ----------
+    path : Union[str, Path]
+        The path to the JSONL file.
+    index_path : Union[str, Path], optional
+        Where to save and load the line offset index (a `.npz` file). Defaults to the path of the file with `.index.npz` appended.
+    persist_index : bool, optional
+        Whether to save the index, and to load a saved one. If the index can't be saved, e.g. because the directory is read-only, it is only kept in memory. Defaults to True.
+    decoder : Callable[[bytes], Any], optional
+        The function used to parse a record. Defaults to `orjson.loads` if orjson is installed, and `json.loads` otherwise. It must be picklable (e.g. not a lambda) to be used with `map_chunks`.
+    block_size : int, optional
+        The number of bytes scanned at a time when building the index. Defaults to 64 MiB.
+
+    Attributes
+    ----------
+    starts : np.ndarray
+        The byte offset where each record starts.
+    ends : np.ndarray
+        The byte offset where each record ends.
+    """
+
+    def __init__(self, path: 'Union[str, Path]', index_path: 'Union[str, Path, None]'=None, persist_index: bool=True, decoder: 'Callable[[bytes], Any]'=default_decoder, block_size: int=64 * 2**20):
+        self.path = path
+        self.index_path = Path(index_path) if index_path is not None else Path(f"{path}.index.npz")
+        self.decoder = decoder
+        self._file = open(path, 'rb')
+        stat = os.fstat(self._file.fileno())
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if stat.st_size else b''
+        self.starts, self.ends = self._load_index(stat) if persist_index else (None, None)
+        if self.starts is None:
+            self.starts, self.ends = self._build_index(block_size)
+            if persist_index:
+                self._save_index(stat)
+
+    def _build_index(self, block_size: int) -> 'Tuple[np.ndarray, np.ndarray]':
+        """Find the start and end offsets of the records. Subclasses can override this to index records that are not lines."""
+        return find_line_offsets(self._mmap, block_size)
+
+    def _load_index(self, stat: os.stat_result) -> tuple:
+        """Load a saved index if it exists and was built for the current version of the file."""
+        if not self.index_path.exists():
+            return None, None
+        with np.load(self.index_path) as saved:
+            if int(saved.get('version', 1)) != _INDEX_VERSION or int(saved['size']) != stat.st_size or int(saved['mtime_ns']) != stat.st_mtime_ns:
+                return None, None
+            return saved['starts'], saved['ends']
+
+    def _save_index(self, stat: os.stat_result):
+        """Save the index next to the file, or keep it only in memory if it can't be written."""
+        try:
+            with open(self.index_path, 'wb') as file:
+                np.savez(file, starts=self.starts, ends=self.ends, size=stat.st_size, mtime_ns=stat.st_mtime_ns, version=_INDEX_VERSION)
+        except OSError as error:
+            print(f"Could not save the index of {self.path} to {self.index_path}: {error}. Keeping it in memory.")
+
+    def __len__(self):
+        return len(self.starts)
+
+    def raw(self, i: int) -> bytes:
+        """Get the unparsed bytes of the record with the given number. Negative numbers count from the end."""
+        return self._mmap[self.starts[i]:self.ends[i]]
+
+    def get(self, i: int) -> Any:
+        """Parse the record with the given number. Negative numbers count from the end."""
+        return self.decoder(self._mmap[self.starts[i]:self.ends[i]])
+
+    def __getitem__(self, key: Union[int, slice]) -> Any:
+        """Parse the record with the given number, or a list of the records in a slice."""
+        if isinstance(key, slice):
+            decoder, buffer = self.decoder, self._mmap
+            return [decoder(buffer[start:end]) for start, end in zip(self.starts[key], self.ends[key])]
+        return self.get(key)
+
+    def __iter__(self) -> Iterator:
+        decoder, buffer = self.decoder, self._mmap
+        for start, end in zip(self.starts, self.ends):
+            yield decoder(buffer[start:end])
+
+    def chunk_bounds(self, chunk_size: int) -> 'List[Tuple[int, int]]':
+        """Split the record numbers into consecutive (start, stop) ranges of at most `chunk_size` records."""
+        return [(start, min(start + chunk_size, len(self))) for start in range(0, len(self), chunk_size)]
+
+    def iter_chunks(self, chunk_size: int=10000) -> 'Iterator[List[Any]]':
+        """Iterate over lists of at most `chunk_size` consecutive parsed records."""
+        for start, stop in self.chunk_bounds(chunk_size):
+            yield self[start:stop]
+
+    def map_chunks(self, func: 'Union[Callable[[List[Any]], Any], None]'=None, chunk_size: int=10000, processes: 'Union[int, None]'=None) -> Iterator:
+        """Parse chunks of at most `chunk_size` consecutive records in parallel worker processes, and yield the result of `func` on each chunk, in file order.
+        - Each worker only reads the bytes of its own chunk, and receives just its slice of the index.
+        - `func` must be picklable, e.g. a function defined at the top level of a module. Without `func`, the parsed chunks are yielded.
+        - Each result is yielded as soon as it and the results before it are ready, and the worker processes are shut down once the iterator is exhausted or closed.
+        """
+        bounds = self.chunk_bounds(chunk_size)
+        with ProcessPoolExecutor(processes) as executor:
+            yield from executor.map(
+                _decode_span,
+                [self.path] * len(bounds),
+                [self.starts[start:stop] for start, stop in bounds],
+                [self.ends[start:stop] for start, stop in bounds],
+                [self.decoder] * len(bounds),
+                [func] * len(bounds),
+            )
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.path})"
+
+    def close(self):
+        """Close the memory map and the file."""
+        if isinstance(self._mmap, mmap.mmap):
+            self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -2,6 +2,8 @@
 This module provides a lightweight set of hooks for tracing data that exists in one structure (e.g. a pandas DataFrame) to data that exists in another structure (e.g. a JSON file). The former is called the `target` and the latter is called the `lookup`.
 
 The main function is `trace`, which takes two datasets, functions that help to relate data from one dataset to the other, and returns a dataframe of location pairs and indices for matching values at those locations.
+Passing a `compatible` function (see `make_compatibility`) to `trace` prunes comparisons between values whose types can never match.
+`trace_sampled` is a faster alternative for large datasets: it traces a sample of the `target` to discover candidate location pairs, and then only verifies those pairs across the full dataset.
 It does not work out of the box, and requires some helper functions to be set up to traverse the data in each of the respective structures. 
 
 Helper functions are either set up as cases for generic functions, or as arguments to the `trace` function:
@@ -9,16 +11,22 @@ Helper functions are either set up as cases for generic functions, or as argumen
 - `get_entry`: a generic function that returns the entry at a given index in a dataset. This must be defined for the `target` dataset.
 - `make_loc_iter`: a generic function that returns an iterator for the locations within an entry of a dataset. This must be defined for both the `target` dataset and the `lookup` dataset.
 - `get_value`: a generic function that returns the value at a given location within an entry of a dataset. This must be defined for both the `target` dataset and the `lookup` dataset.
-- `identify`: a function argument for `trace` that returns the index and entry of an entry in the `lookup` dataset that matches the entry in the `target` dataset at a given index.
+- `identify`: a function argument for `trace` that returns the index and entry of an entry in the `lookup` dataset that matches the entry in the `target` dataset at a given index. `make_indexed_identify` builds one from a hash index over the `lookup` dataset.
 - `is_match`: a function argument for `trace` that returns whether two values are considered equal.
 
-See ``data_tracer_demo.py`` for examples of how to define these functions.
+See ``lineage_tracer_demo.py`` for examples of how to define these functions, and ``lineage_tracer_hooks.py`` for optimized built-in hooks for dataframes, lists of dicts and structured arrays.
 """
 
+from collections import OrderedDict, defaultdict
+from datetime import date
 from functools import singledispatch
-from itertools import product
+import math
+from random import Random
+import re
 import sys
-from typing import Any, Callable, Iterator, Tuple
+from time import perf_counter
+from typing import Any, Callable, Hashable, Iterable, Iterator, Tuple, Union
+import numpy as np
 import pandas as pd
 
 @singledispatch
@@ -94,7 +102,285 @@ def get_value(entry: Any, location: Any) -> Any:
     """
     raise NotImplementedError('`get_value` is not implemented for the given type: {}'.format(type(entry)))
 
-def trace(target: Any, lookup: Any, identify: 'Callable[[Any, Any, Any], Any]', is_match: 'Callable[[Any, Any, Any, Any], Tuple[bool, str]]', analytics: 'list[Callable[[Any, Any, Any, Any], Any]]' ) -> pd.DataFrame:
+MATCH_COLUMNS = ['target_location', 'target_idx', 'target_value', 'lookup_location', 'lookup_idx', 'lookup_value', 'note']
+_MISSING = object()
+
+def _hashable_location(location: Any) -> Hashable:
+    """Locations such as key paths may be lists; convert them so that they can be grouped."""
+    return tuple(location) if isinstance(location, list) else location
+
+def _make_key_func(key: 'Union[list, Callable[[Any], Hashable]]') -> 'Callable[[Any], Hashable]':
+    """Turn a list of locations, or a user key function, into a function that computes the key of an entry."""
+    if callable(key):
+        return key
+    locations = list(key)
+    return lambda entry: tuple(get_value(entry, location) for location in locations)
+
+def _iter_keys(dataset: Any, key: 'Union[list, Callable[[Any], Hashable]]') -> 'Iterator[Tuple[Any, Hashable]]':
+    """Iterate over the (index, key) pairs of all entries in a dataset."""
+    if isinstance(dataset, pd.DataFrame) and not callable(key):
+        # read the key columns directly instead of building a row for every entry
+        return enumerate(zip(*(dataset[location] for location in key)))
+    key_func = _make_key_func(key)
+    return ((idx, key_func(get_entry(dataset, idx))) for idx in make_idx_iter(dataset))
+
+def make_indexed_identify(lookup: Any, lookup_key: 'Union[list, Callable[[Any], Hashable]]', target_key: 'Union[list, Callable[[Any], Hashable], None]'=None, on_multiple: str='first', on_missing: str='skip') -> 'Callable[[Any, Any, Any], Any]':
+    """Build a hash index over the `lookup` dataset once, and return an `identify` function for `trace` that finds the lookup entry for a target entry in constant time.
+    - Keys are either a list of locations (e.g. column names or key paths), whose values are combined into a tuple, or a function that takes an entry and returns a hashable key.
+    - The lookup dataset must support `make_idx_iter` and `get_entry`, except for dataframes keyed on columns, which are read column-wise.
+
+    Parameters
+    ----------
+    lookup : Any
+        The dataset where the information in the target dataset will be looked up.
+    lookup_key : Union[list, Callable[[Any], Hashable]]
+        The locations of the key values in lookup entries, or a function that computes the key of a lookup entry.
+    target_key : Union[list, Callable[[Any], Hashable]], optional
+        The locations of the key values in target entries, or a function that computes the key of a target entry. Defaults to `lookup_key`.
+    on_multiple : str, optional
+        What to do when several lookup entries share a key: 'first' or 'last' to use the first or last such entry, or 'raise' to raise a `KeyError` when the key is looked up. Defaults to 'first'.
+    on_missing : str, optional
+        What to do when no lookup entry has the key of a target entry: 'skip' to return None, which makes `trace` skip the entry, or 'raise' to raise a `KeyError`. Defaults to 'skip'.
+
+    Returns
+    -------
+    Callable[[Any, Any, Any], Any]
+        An `identify` function that returns the index and entry in `lookup` that match a target entry.
+    """
+    if on_multiple not in ('first', 'last', 'raise'):
+        raise ValueError(f"`on_multiple` must be 'first', 'last' or 'raise', not {on_multiple!r}")
+    if on_missing not in ('skip', 'raise'):
+        raise ValueError(f"`on_missing` must be 'skip' or 'raise', not {on_missing!r}")
+    index = {}
+    duplicates = set()
+    for lookup_idx, key in _iter_keys(lookup, lookup_key):
+        if key not in index:
+            index[key] = lookup_idx
+        elif on_multiple == 'last':
+            index[key] = lookup_idx
+        elif on_multiple == 'raise':
+            duplicates.add(key)
+    target_key_func = _make_key_func(lookup_key if target_key is None else target_key)
+
+    def identify(lookup: Any, target_idx: Any, target_entry: Any) -> 'Union[Tuple[Any, Any], None]':
+        key = target_key_func(target_entry)
+        if key in duplicates:
+            raise KeyError(f"Multiple lookup entries match key {key!r} of target entry {target_idx}")
+        lookup_idx = index.get(key, _MISSING)
+        if lookup_idx is _MISSING:
+            if on_missing == 'raise':
+                raise KeyError(f"No lookup entry matches key {key!r} of target entry {target_idx}")
+            return None
+        return lookup_idx, get_entry(lookup, lookup_idx)
+    return identify
+
+_DATE_PATTERN = re.compile(r'^\d{4}-\d{1,2}-\d{1,2}([T ]\d{1,2}:\d{2}(:\d{2}(\.\d+)?)?)?(Z|[+-]\d{2}:?\d{2})?$|^\d{1,2}[/.-]\d{1,2}[/.-]\d{2,4}$')
+
+def _magnitude(number: float) -> 'Union[int, None]':
+    """The order of magnitude of a number, or None for zero and non-finite numbers."""
+    if number == 0 or not math.isfinite(number):
+        return None
+    return math.floor(math.log10(abs(number)))
+
+def value_signature(value: Any) -> tuple:
+    """Compute a cheap signature of a value, used to bucket values whose types can never match in `trace`.
+    - Nulls: ('null',)
+    - Booleans: ('bool',)
+    - Numbers: ('number', order of magnitude)
+    - Dates and times: ('datetime',)
+    - Strings: ('string', length bucket, whether the string looks like a date, whether the string is a number, its order of magnitude if it is)
+    - Anything else: ('other', type name)
+    Orders of magnitude are None for zero and non-finite numbers. Whether a string is a number has its own flag, since a magnitude of 0 would be equal to False, and signatures that are equal share a bucket in `trace`.
+
+    >>> value_signature('2020-01-01')
+    ('string', 4, True, False, None)
+    """
+    if value is None:
+        return ('null',)
+    if isinstance(value, (bool, np.bool_)):
+        return ('bool',)
+    if isinstance(value, (int, float, np.number)):
+        return ('null',) if value != value else ('number', _magnitude(float(value)))
+    if isinstance(value, (date, np.datetime64)):
+        return ('null',) if pd.isna(value) else ('datetime',)
+    if isinstance(value, str):
+        try:
+            magnitude = _magnitude(float(value))
+            is_number = True
+        except ValueError:
+            magnitude, is_number = None, False
+        return ('string', len(value).bit_length(), _DATE_PATTERN.match(value) is not None, is_number, magnitude)
+    return ('other', type(value).__name__)
+# test_value_signature = [value_signature(value) for value in [None, True, 1234.5, pd.Timestamp('2020-01-01'), 'abc', '12.5', {'a': 1}]]
+
+def make_compatibility(magnitude_gap: 'Union[int, None]'=1, length_gap: 'Union[int, None]'=1) -> 'Callable[[tuple, tuple], bool]':
+    """Create a function that checks whether the signatures from `value_signature` of two values are compatible, i.e. whether the values could possibly match.
+    - Values with signatures of unknown kinds are always compatible, and nulls are only compatible with nulls.
+    - Numbers are compatible with numbers and numeric strings of a similar magnitude, and booleans are compatible with numbers.
+    - Dates and times are compatible with each other and with strings that look like dates.
+    - Strings are compatible with strings of a similar length.
+
+    Parameters
+    ----------
+    magnitude_gap : int, optional
+        The largest difference in orders of magnitude between compatible numbers, or None to ignore magnitudes (e.g. for matchers such as `is_ten_power`). Defaults to 1.
+    length_gap : int, optional
+        The largest difference in length buckets (powers of two) between compatible strings, or None to ignore lengths (e.g. for substring matchers). Defaults to 1.
+
+    Returns
+    -------
+    Callable[[tuple, tuple], bool]
+        The compatibility function, to be passed to `trace` as `compatible`.
+    """
+    def _close(x: 'Union[int, None]', y: 'Union[int, None]', gap: 'Union[int, None]') -> bool:
+        return gap is None or x is None or y is None or abs(x - y) <= gap
+
+    def _number_like(signature: tuple) -> 'Union[Tuple[bool, Union[int, None]], None]':
+        if signature[0] == 'number':
+            return True, signature[1]
+        if signature[0] == 'bool':
+            return True, None
+        if signature[0] == 'string' and signature[3]:
+            return True, signature[4]
+        return None
+
+    def compatible(signature_1: tuple, signature_2: tuple) -> bool:
+        kind_1, kind_2 = signature_1[0], signature_2[0]
+        if kind_1 == 'other' or kind_2 == 'other':
+            return True
+        if kind_1 == 'null' or kind_2 == 'null':
+            return kind_1 == kind_2
+        if kind_1 == 'string' and kind_2 == 'string':
+            return _close(signature_1[1], signature_2[1], length_gap)
+        if kind_1 == 'datetime' or kind_2 == 'datetime':
+            return all(kind == 'datetime' or (kind == 'string' and signature[2]) for kind, signature in ((kind_1, signature_1), (kind_2, signature_2)))
+        number_1, number_2 = _number_like(signature_1), _number_like(signature_2)
+        return number_1 is not None and number_2 is not None and _close(number_1[1], number_2[1], magnitude_gap)
+    return compatible
+# test_compatible = make_compatibility()(value_signature(105), value_signature('99.5'))
+
+class MatchMemo:
+    """
+    A bounded, least-recently-used memo cache around an `is_match` function for `trace`, so that expensive matchers only run once per distinct pair of values and locations.
+
+    Values are cached together with their types, so that e.g. `1`, `1.0` and `True` are not confused. Calls with unhashable values bypass the cache.
+
+    Parameters
+    ----------
+    is_match : Callable[[Any, Any, Any, Any], Tuple[bool, str]]
+        The function to memoize.
+    maxsize : int, optional
+        The maximum number of cached results. Defaults to 100000.
+
+    Attributes
+    ----------
+    hits : int
+        The number of calls answered from the cache.
+    misses : int
+        The number of calls that ran `is_match` and cached the result.
+    uncached : int
+        The number of calls that ran `is_match` because their values were unhashable.
+    """
+
+    def __init__(self, is_match: 'Callable[[Any, Any, Any, Any], Tuple[bool, str]]', maxsize: int=100000):
+        self.is_match = is_match
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.uncached = 0
+        self._cache: 'OrderedDict[Hashable, Tuple[bool, str]]' = OrderedDict()
+
+    def __call__(self, target_value: Any, lookup_value: Any, target_location: Any, lookup_location: Any) -> 'Tuple[bool, str]':
+        key = (type(target_value), target_value, type(lookup_value), lookup_value, _hashable_location(target_location), _hashable_location(lookup_location))
+        try:
+            result = self._cache[key]
+        except KeyError:
+            pass
+        except TypeError:
+            self.uncached += 1
+            return self.is_match(target_value, lookup_value, target_location, lookup_location)
+        else:
+            self.hits += 1
+            self._cache.move_to_end(key)
+            return result
+        self.misses += 1
+        result = self.is_match(target_value, lookup_value, target_location, lookup_location)
+        self._cache[key] = result
+        if len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+        return result
+
+    @property
+    def hit_rate(self) -> float:
+        """The share of calls answered from the cache."""
+        calls = self.hits + self.misses + self.uncached
+        return self.hits / calls if calls else 0.0
+
+    def cache_info(self) -> dict:
+        """Get the hit, miss and size statistics of the cache."""
+        return {'hits': self.hits, 'misses': self.misses, 'uncached': self.uncached, 'hit_rate': self.hit_rate, 'maxsize': self.maxsize, 'currsize': len(self._cache)}
+
+    def clear(self):
+        """Clear the cache and its statistics."""
+        self._cache.clear()
+        self.hits = self.misses = self.uncached = 0
+
+class TraceProfiler:
+    """
+    Records call counts and timings of the hooks called by `trace`, per hook and per type of the first argument (i.e. the registered type for generic hooks).
+
+    Every call is counted and timed, but percentiles are computed from a bounded random sample of the call durations, to keep memory constant over long traces.
+
+    Parameters
+    ----------
+    sample_size : int, optional
+        The maximum number of call durations kept per hook and type for computing percentiles. Defaults to 10000.
+    seed : int, optional
+        The seed for sampling call durations.
+    """
+
+    def __init__(self, sample_size: int=10000, seed: 'Union[int, None]'=None):
+        self.sample_size = sample_size
+        self._rng = Random(seed)
+        self._counts: 'dict[Tuple[str, str], int]' = defaultdict(int)
+        self._totals: 'dict[Tuple[str, str], float]' = defaultdict(float)
+        self._samples: 'dict[Tuple[str, str], list[float]]' = defaultdict(list)
+
+    def record(self, hook: str, kind: str, seconds: float):
+        """Record a single call of a hook that took the given number of seconds."""
+        key = (hook, kind)
+        self._counts[key] += 1
+        self._totals[key] += seconds
+        samples = self._samples[key]
+        if len(samples) < self.sample_size:
+            samples.append(seconds)
+        else:
+            # reservoir sampling keeps every call equally likely to be in the sample
+            position = self._rng.randrange(self._counts[key])
+            if position < self.sample_size:
+                samples[position] = seconds
+
+    def wrap(self, hook: str, func: Callable, get_kind: 'Callable[[tuple], str]'=lambda args: type(args[0]).__name__) -> Callable:
+        """Wrap a hook so that its calls are recorded. Iterators returned by the hook are consumed within the timing, so that lazy iteration is attributed to the hook."""
+        def timed(*args):
+            start = perf_counter()
+            try:
+                result = func(*args)
+                return list(result) if isinstance(result, Iterator) else result
+            finally:
+                self.record(hook, get_kind(args), perf_counter() - start)
+        return timed
+
+    def summary(self) -> pd.DataFrame:
+        """Get a dataframe with the number of calls, total time and time percentiles of each hook and type, sorted by total time."""
+        rows = []
+        for (hook, kind), count in self._counts.items():
+            percentiles = np.percentile(self._samples[(hook, kind)], [50, 90, 99]) * 1e6
+            rows.append([hook, kind, count, self._totals[(hook, kind)], self._totals[(hook, kind)] / count * 1e6, *percentiles])
+        summary = pd.DataFrame(rows, columns=['hook', 'type', 'calls', 'total_s', 'mean_us', 'p50_us', 'p90_us', 'p99_us'])
+        return summary.sort_values('total_s', ascending=False, ignore_index=True)
+
+def trace(target: Any, lookup: Any, identify: 'Callable[[Any, Any, Any], Any]', is_match: 'Callable[[Any, Any, Any, Any], Tuple[bool, str]]', analytics: 'list[Callable[[Any, Any, Any, Any], Any]]'=(), indices: 'Union[Iterable, None]'=None, compatible: 'Union[Callable[[Hashable, Hashable], bool], None]'=None, signature: 'Callable[[Any], Hashable]'=value_signature, memo_size: 'Union[int, None]'=None, profile: 'Union[bool, TraceProfiler]'=False, batch_analytics: 'list[Callable[[pd.DataFrame], Any]]'=(), analytics_chunk_size: int=1000, completed: 'Union[list, None]'=None) -> 'Union[pd.DataFrame, Tuple[pd.DataFrame, pd.DataFrame]]':
     """Given two datasets, return a dataframe of location pairs and matching entry numbers for each pair.
 
     Parameters
@@ -104,43 +390,285 @@ def trace(target: Any, lookup: Any, identify: 'Callable[[Any, Any, Any], Any]',
     lookup : Any
         The dataset where the information in `target` will be looked up.
     identify : Callable[[Any, Any, Any], Any]
-        A function that can be used to identify entries from the target dataset with entries in the lookup dataset.
+        A function that can be used to identify entries from the target dataset with entries in the lookup dataset. It returns the index and entry in the lookup dataset, or None if the target entry should be skipped. See `make_indexed_identify` for a hash-indexed implementation.
     is_match : Callable[[Any, Any, Any, Any], Tuple[bool, str]]
         A function that can be used to check if the values at two locations are considered equal.
-    analytics : list[Callable[[Any, Any, Any, Any], Any]]
-        A list of functions that can be used to perform additional analysis on the entries.
+    analytics : list[Callable[[Any, Any, Any, Any], Any]], optional
+        A list of functions that can be used to perform additional analysis on the entries. Each function is called once per target location of each traced entry, with the target index, entry, location and value.
+    indices : Iterable, optional
+        The indices of the target entries to trace. Defaults to all indices given by `make_idx_iter`.
+    compatible : Callable[[Hashable, Hashable], bool], optional
+        A function that takes the signatures of a target value and a lookup value, and returns whether the values could possibly match. If given, the lookup values of each entry are bucketed by signature, and `is_match` is only called on values from compatible buckets. See `make_compatibility`.
+    signature : Callable[[Any], Hashable], optional
+        A function that computes a cheap, hashable signature of a value, used for pruning with `compatible`. Defaults to `value_signature`.
+    memo_size : int, optional
+        If given, `is_match` results are memoized across entries in a `MatchMemo` of this size, and its hit rate is reported at the end. Pass a `MatchMemo` as `is_match` instead to keep the cache and its statistics.
+    profile : Union[bool, TraceProfiler], optional
+        Whether to record call counts and timings of every hook, per hook and per type, with a `TraceProfiler`. A profiler can be passed in to accumulate timings across several traces. Defaults to False.
+    batch_analytics : list[Callable[[pd.DataFrame], Any]], optional
+        A list of functions that analyze the target values in batches, e.g. with vectorized pandas operations, instead of one value at a time like `analytics`. Each function is called with a dataframe that has one row per target location of the traced entries, with the columns 'target_idx', 'target_location' and 'target_value'. Its return value is ignored.
+        A batch is passed after every `analytics_chunk_size` traced entries, and the last, partial batch once the trace ends, including when it is interrupted. If a function raises an error, the error is printed and the trace continues with the next function and batch.
+    analytics_chunk_size : int, optional
+        The number of traced entries in each batch passed to `batch_analytics`. Defaults to 1000.
+    completed : list, optional
+        If given, the index of every target entry that was traced to the end without any error reading its values or checking a match is appended to it. Entries that failed, and entries that were not reached because the trace was interrupted, are left out.
 
     Returns
     -------
-    DataFrame
-        A dataframe of location pairs and matching entry numbers for each pair.
+    Union[DataFrame, Tuple[DataFrame, DataFrame]]
+        A dataframe of location pairs and matching entry numbers for each pair. When profiling, a tuple of that dataframe and the profiler's summary.
     """
-    matches = pd.DataFrame(columns=['target_location', 'target_idx', 'target_value', 'lookup_location', 'lookup_idx', 'lookup_value', 'note'])
-    indices = make_idx_iter(target)
+    matches = []
+    compatibility = {}
+    if memo_size is not None:
+        is_match = MatchMemo(is_match, memo_size)
+    _get_entry, _identify, _make_loc_iter, _get_value, _is_match, _signature = get_entry, identify, make_loc_iter, get_value, is_match, signature
+    _analytics, _batch_analytics = list(analytics), list(batch_analytics)
+    profiler = None
+    if profile:
+        profiler = profile if isinstance(profile, TraceProfiler) else TraceProfiler()
+        _get_entry = profiler.wrap('get_entry', get_entry)
+        _identify = profiler.wrap('identify', identify)
+        _make_loc_iter = profiler.wrap('make_loc_iter', make_loc_iter)
+        _get_value = profiler.wrap('get_value', get_value)
+        _is_match = profiler.wrap('is_match', is_match, lambda args: f"{type(args[0]).__name__}, {type(args[1]).__name__}")
+        _signature = profiler.wrap('signature', signature)
+        _analytics = [profiler.wrap('analytics', analyze, lambda args, name=getattr(analyze, '__name__', repr(analyze)): name) for analyze in analytics]
+        _batch_analytics = [profiler.wrap('batch_analytics', analyze_batch, lambda args, name=getattr(analyze_batch, '__name__', repr(analyze_batch)): name) for analyze_batch in batch_analytics]
+    def _is_compatible(target_signature: Hashable, lookup_signature: Hashable) -> bool:
+        # signatures are coarse, so the number of distinct signature pairs stays small across the whole trace
+        key = (target_signature, lookup_signature)
+        if key not in compatibility:
+            compatibility[key] = compatible(target_signature, lookup_signature)
+        return compatibility[key]
+    batch = []
+    batch_entry_count = 0
+    entry_errors = 0
+    def _flush_batch():
+        nonlocal batch, batch_entry_count
+        if batch:
+            columns = pd.DataFrame(batch, columns=['target_idx', 'target_location', 'target_value'])
+            for analyze_batch in _batch_analytics:
+                try:
+                    analyze_batch(columns)
+                except:
+                    print(f"Error: {sys.exc_info()[0]}. {sys.exc_info()[1]}, line: {sys.exc_info()[2].tb_lineno}")
+                    print(f"Error analyzing batch of target entries {batch[0][0]} to {batch[-1][0]}")
+        batch, batch_entry_count = [], 0
+    def _read_values(entry: Any, entry_idx: Any) -> 'list[Tuple[Any, Any]]':
+        nonlocal entry_errors
+        values = []
+        for location in _make_loc_iter(entry):
+            try:
+                values.append((location, _get_value(entry, location)))
+            except:
+                entry_errors += 1
+                print(f"Error: {sys.exc_info()[0]}. {sys.exc_info()[1]}, line: {sys.exc_info()[2].tb_lineno}")
+                print(f"Error reading location {location} of entry {entry_idx}")
+        return values
+
+    if indices is None:
+        indices = make_idx_iter(target)
+    entry_count = 0
     for target_idx in indices:
+        entry_count += 1
+        entry_errors = 0
         try:
-            target_entry = get_entry(target, target_idx)
-            lookup_idx, lookup_entry = identify(lookup, target_idx, target_entry)
-            target_locations = make_loc_iter(target_entry)
-            lookup_locations = make_loc_iter(lookup_entry)
-            for target_location, lookup_location in product(target_locations, lookup_locations):
+            target_entry = _get_entry(target, target_idx)
+            identified = _identify(lookup, target_idx, target_entry)
+            if identified is None:
+                if completed is not None:
+                    completed.append(target_idx)
+                continue
+            lookup_idx, lookup_entry = identified
+            target_values = _read_values(target_entry, target_idx)
+            lookup_values = _read_values(lookup_entry, lookup_idx)
+            lookup_buckets = {None: lookup_values}
+            if compatible is not None:
+                lookup_buckets = defaultdict(list)
+                for lookup_location, lookup_value in lookup_values:
+                    lookup_buckets[_signature(lookup_value)].append((lookup_location, lookup_value))
+            for target_location, target_value in target_values:
                 try:
-                    target_value = get_value(target_entry, target_location)
-                    lookup_value = get_value(lookup_entry, lookup_location)
-                    for analyze in analytics:
+                    for analyze in _analytics:
                         analyze(target_idx, target_entry, target_location, target_value)
-                    has_matched, match_note = is_match(target_value, lookup_value, target_location, lookup_location)
-                    if has_matched:
-                        matches.loc[len(matches)] = [target_location, target_idx, target_value, lookup_location, lookup_idx, lookup_value, match_note]
                 except:
                     print(f"Error: {sys.exc_info()[0]}. {sys.exc_info()[1]}, line: {sys.exc_info()[2].tb_lineno}")
-                    print(f"Error tracing lookup location {lookup_location} while on target location {target_location} and index {target_idx}")
+                    print(f"Error analyzing target location {target_location} and index {target_idx}")
+                if _batch_analytics:
+                    batch.append((target_idx, target_location, target_value))
+                target_signature = None if compatible is None else _signature(target_value)
+                for lookup_signature, lookup_bucket in lookup_buckets.items():
+                    if compatible is not None and not _is_compatible(target_signature, lookup_signature):
+                        continue
+                    for lookup_location, lookup_value in lookup_bucket:
+                        try:
+                            has_matched, match_note = _is_match(target_value, lookup_value, target_location, lookup_location)
+                            if has_matched:
+                                matches.append([target_location, target_idx, target_value, lookup_location, lookup_idx, lookup_value, match_note])
+                        except:
+                            entry_errors += 1
+                            print(f"Error: {sys.exc_info()[0]}. {sys.exc_info()[1]}, line: {sys.exc_info()[2].tb_lineno}")
+                            print(f"Error tracing lookup location {lookup_location} while on target location {target_location} and index {target_idx}")
+            batch_entry_count += 1
+            if batch_entry_count >= analytics_chunk_size:
+                _flush_batch()
+            if completed is not None and not entry_errors:
+                completed.append(target_idx)
         except KeyboardInterrupt:
             print('Data trace interrupted by user. Returning partial results.')
-            return matches
+            break
         except:
             print(f"Error: {sys.exc_info()[0]}. {sys.exc_info()[1]}, line: {sys.exc_info()[2].tb_lineno}")
             print(f"Error tracing targe entry {target_idx} due to unhandled exception. Skipping.")
-    print(f"Successfully found {len(matches)} potential matching values across {len(indices)} entries in the target dataset.")
-    return matches
+    else:
+        print(f"Successfully found {len(matches)} potential matching values across {entry_count} entries in the target dataset.")
+    _flush_batch()
+    if isinstance(is_match, MatchMemo):
+        print(f"Match memo hit rate: {is_match.hit_rate:.1%} ({is_match.hits} hits, {is_match.misses} misses, {is_match.uncached} uncached).")
+    if profiler is not None:
+        return pd.DataFrame(matches, columns=MATCH_COLUMNS), profiler.summary()
+    return pd.DataFrame(matches, columns=MATCH_COLUMNS)
+
+def sample_target_indices(target: Any, sample_size: int, stratify: 'Union[Callable[[Any, Any], Hashable], None]'=None, seed: 'Union[int, None]'=None) -> list:
+    """Draw a random sample of indices from the target dataset, optionally stratified so that every stratum is represented in proportion to its size.
+
+    Parameters
+    ----------
+    target : Any
+        The dataset to sample from.
+    sample_size : int
+        The number of indices to sample. Stratified samples may be slightly larger, since every stratum gets at least one index.
+    stratify : Callable[[Any, Any], Hashable], optional
+        A function that takes a target index and entry and returns the stratum that the entry belongs to.
+    seed : int, optional
+        The seed for the random number generator.
+
+    Returns
+    -------
+    list
+        The sampled indices, in the order given by `make_idx_iter`.
+    """
+    rng = Random(seed)
+    all_indices = list(make_idx_iter(target))
+    if stratify is None:
+        if sample_size >= len(all_indices):
+            return all_indices
+        positions = sorted(rng.sample(range(len(all_indices)), sample_size))
+        return [all_indices[position] for position in positions]
+    strata = defaultdict(list)
+    for position, target_idx in enumerate(all_indices):
+        strata[stratify(target_idx, get_entry(target, target_idx))].append(position)
+    positions = []
+    for stratum_positions in strata.values():
+        stratum_size = max(1, round(sample_size * len(stratum_positions) / len(all_indices)))
+        positions.extend(rng.sample(stratum_positions, min(stratum_size, len(stratum_positions))))
+    return [all_indices[position] for position in sorted(positions)]
+
+def trace_sampled(target: Any, lookup: Any, identify: 'Callable[[Any, Any, Any], Any]', is_match: 'Callable[[Any, Any, Any, Any], Tuple[bool, str]]', sample_size: int=1000, stratify: 'Union[Callable[[Any, Any], Hashable], None]'=None, seed: 'Union[int, None]'=None, min_sample_matches: int=1, is_match_batch: 'Union[Callable[[pd.Series, pd.Series, Any, Any], Any], None]'=None) -> 'Tuple[pd.DataFrame, pd.DataFrame]':
+    """Trace a sample of the target dataset to discover candidate location pairs, then verify only those pairs across the full target dataset.
+    - The first phase runs `trace` on a random (or stratified) sample of target entries. Every location pair with at least `min_sample_matches` matches in the sample becomes a candidate.
+    - The second phase goes through every target entry once, reading only the values at candidate locations into columns, and then checks each candidate pair column against column.
+
+    Parameters
+    ----------
+    target : Any
+        The dataset to be traced.
+    lookup : Any
+        The dataset where the information in `target` will be looked up.
+    identify : Callable[[Any, Any, Any], Any]
+        A function that can be used to identify entries from the target dataset with entries in the lookup dataset. See `trace`.
+    is_match : Callable[[Any, Any, Any, Any], Tuple[bool, str]]
+        A function that can be used to check if the values at two locations are considered equal.
+    sample_size : int, optional
+        The number of target entries to trace in the discovery phase. Defaults to 1000.
+    stratify : Callable[[Any, Any], Hashable], optional
+        A function that takes a target index and entry and returns its stratum, to stratify the sample. See `sample_target_indices`.
+    seed : int, optional
+        The seed used to draw the sample.
+    min_sample_matches : int, optional
+        The number of matches in the sample that a location pair needs to become a candidate. Defaults to 1.
+    is_match_batch : Callable[[pd.Series, pd.Series, Any, Any], Any], optional
+        A vectorized counterpart of `is_match` that takes aligned series of target and lookup values and the two locations, and returns an array of booleans. If not given, `is_match` is called on each pair of values.
+
+    Returns
+    -------
+    Tuple[DataFrame, DataFrame]
+        A dataframe of candidate location pairs with their sample match counts, number of compared entries, number of matched entries and match rate across the full dataset, and a dataframe of all verified matches in the same format as `trace`.
+    """
+    sample = sample_target_indices(target, sample_size, stratify, seed)
+    sample_matches = trace(target, lookup, identify, is_match, indices=sample)
+
+    # collect the candidate location pairs, keeping the original locations around to read values with
+    target_locations, lookup_locations = {}, {}
+    sample_counts = defaultdict(int)
+    for target_location, lookup_location in zip(sample_matches['target_location'], sample_matches['lookup_location']):
+        target_key, lookup_key = _hashable_location(target_location), _hashable_location(lookup_location)
+        target_locations[target_key], lookup_locations[lookup_key] = target_location, lookup_location
+        sample_counts[(target_key, lookup_key)] += 1
+    candidates = [pair for pair, count in sample_counts.items() if count >= min_sample_matches]
+    target_locations = {key: target_locations[key] for key, _ in candidates}
+    lookup_locations = {key: lookup_locations[key] for _, key in candidates}
+
+    # read the values at the candidate locations of every entry into columns
+    target_idxs, lookup_idxs = [], []
+    target_columns = {key: [] for key in target_locations}
+    lookup_columns = {key: [] for key in lookup_locations}
+    def _read(entry: Any, location: Any) -> Any:
+        try:
+            return get_value(entry, location)
+        except (KeyError, IndexError, TypeError):
+            return _MISSING
+    for target_idx in make_idx_iter(target):
+        try:
+            target_entry = get_entry(target, target_idx)
+            identified = identify(lookup, target_idx, target_entry)
+            if identified is None:
+                continue
+            lookup_idx, lookup_entry = identified
+            target_values = [_read(target_entry, location) for location in target_locations.values()]
+            lookup_values = [_read(lookup_entry, location) for location in lookup_locations.values()]
+        except KeyboardInterrupt:
+            print('Data trace verification interrupted by user. Verifying partial results.')
+            break
+        except:
+            print(f"Error: {sys.exc_info()[0]}. {sys.exc_info()[1]}, line: {sys.exc_info()[2].tb_lineno}")
+            print(f"Error reading target entry {target_idx} due to unhandled exception. Skipping.")
+            continue
+        target_idxs.append(target_idx)
+        lookup_idxs.append(lookup_idx)
+        for column, value in zip(target_columns.values(), target_values):
+            column.append(value)
+        for column, value in zip(lookup_columns.values(), lookup_values):
+            column.append(value)
 
+    # verify each candidate pair column against column
+    # columns without missing values are turned into series once and shared by all of their pairs, so that matchers that cache per column object, such as the vectorized matchers of ``minor.py``, only parse them once
+    full_series = {}
+    def _series(side: str, key: Hashable, column: list, rows: 'list[int]') -> pd.Series:
+        if len(rows) < len(column):
+            return pd.Series([column[row] for row in rows])
+        if (side, key) not in full_series:
+            full_series[(side, key)] = pd.Series(column)
+        return full_series[(side, key)]
+    pair_rates, matches = [], []
+    for target_key, lookup_key in candidates:
+        target_location, lookup_location = target_locations[target_key], lookup_locations[lookup_key]
+        rows = [row for row, (target_value, lookup_value) in enumerate(zip(target_columns[target_key], lookup_columns[lookup_key])) if target_value is not _MISSING and lookup_value is not _MISSING]
+        target_values = _series('target', target_key, target_columns[target_key], rows)
+        lookup_values = _series('lookup', lookup_key, lookup_columns[lookup_key], rows)
+        if is_match_batch is not None:
+            has_matched = pd.Series(is_match_batch(target_values, lookup_values, target_location, lookup_location)).fillna(False).astype(bool).tolist()
+            notes = ['Verified in batch'] * len(rows)
+        else:
+            results = [is_match(target_value, lookup_value, target_location, lookup_location) for target_value, lookup_value in zip(target_values, lookup_values)]
+            has_matched = [result[0] for result in results]
+            notes = [result[1] for result in results]
+        for row, target_value, lookup_value, matched, note in zip(rows, target_values, lookup_values, has_matched, notes):
+            if matched:
+                matches.append([target_location, target_idxs[row], target_value, lookup_location, lookup_idxs[row], lookup_value, note])
+        matched_count = sum(has_matched)
+        pair_rates.append([target_location, lookup_location, sample_counts[(target_key, lookup_key)], len(rows), matched_count, matched_count / len(rows) if rows else float('nan')])
+    pair_rates = pd.DataFrame(pair_rates, columns=['target_location', 'lookup_location', 'sample_matches', 'compared', 'matched', 'match_rate'])
+    print(f"Verified {len(candidates)} candidate location pairs across {len(target_idxs)} entries in the target dataset.")
+    return pair_rates.sort_values('match_rate', ascending=False, ignore_index=True), pd.DataFrame(matches, columns=MATCH_COLUMNS)
@@ -4,7 +4,7 @@
 import json
 from typing import Any, Iterator, Tuple, Union
 import pandas as pd
-from data_tracer import get_entry, get_value, make_idx_iter, make_loc_iter, trace
+from lineage_tracer_core import get_entry, get_value, make_idx_iter, make_indexed_identify, make_loc_iter, trace
 
 @make_idx_iter.register
 def _(dataset: pd.DataFrame) -> Iterator:
@@ -12,6 +12,12 @@ def _(dataset: pd.DataFrame) -> Iterator:
     return iter(range(len(dataset)))
 # test_make_idx_iter_df = make_idx_iter(pd.DataFrame({'c1': [10, 11, 12], 'c2': [100, 110, 120]}))
 
+@make_idx_iter.register
+def _(dataset: list) -> Iterator:
+    """Iterates over all indices for items in a list."""
+    return iter(range(len(dataset)))
+# test_make_idx_iter_list = make_idx_iter([{'c1': 10}, {'c1': 11}])
+
 @make_loc_iter.register
 def _(entry: pd.Series) -> Iterator:
     """Iterates over the names of a pandas Series."""
@@ -39,6 +45,12 @@ def _(dataset: pd.DataFrame, idx: int) -> pd.Series:
     return dataset.iloc[idx]
 # test_get_entry_df = get_entry(pd.DataFrame({'c1': [10, 11, 12], 'c2': [100, 110, 120]}), 1)
 
+@get_entry.register
+def _(dataset: list, idx: int) -> Any:
+    """Returns the item at the given index in a list."""
+    return dataset[idx]
+# test_get_entry_list = get_entry([{'c1': 10}, {'c1': 11}], 1)
+
 @get_value.register
 def _(entry: dict, location: list) -> Any:
     """Returns the value of a dict at the given path by sequentially going down the key list."""
@@ -73,21 +85,26 @@ def identify(lookup_json: 'list[dict]', target_idx: int, target_entry_df: pd.Ser
     Tuple[int, pd.Series]
         The index and the corresponding entry in the lookup list.
     """
-    return [(idx, entry) for idx, entry in enumerate(lookup_json) if idx == target_idx][0]
-# test_identify = dummy_identify(lookup, 1, target.iloc[1])
+    return target_idx, lookup_json[target_idx]
+# test_identify = identify(lookup, 1, target.iloc[1])
 
 target = pd.DataFrame({'c1': [10, 11, 12], 'c2': [100, 110, 500]})
 lookup = [{'c1': 10, 'c2': 100}, {'c1': 11, 'c2': 110}, {'c1': 12, 'c2': 120, 'c3': {'c3_1': 500}}]
 is_match = lambda x, y, *args: (x == y, 'Placeholder note!')
+# identifies lookup entries by hashing the lookup dataset on a key path, instead of relying on the position of the entries
+identify_by_c1 = make_indexed_identify(lookup, lookup_key=[['c1']], target_key=['c1'])
 
 def main():
     test_trace = trace(target, lookup, identify, is_match)
+    test_trace_indexed = trace(target, lookup, identify_by_c1, is_match)
     print('\ntarget:')
     print(target)
     print('\nlookup:')
     print(json.dumps(lookup, indent=4))
     print('\ntest_trace:')
     print(test_trace)
+    print('\ntest_trace_indexed:')
+    print(test_trace_indexed)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,151 @@
+"""
+This module registers optimized implementations of the generic hooks in ``lineage_tracer_core.py`` for common dataset types, so that `trace` can be run on them without writing any hooks.
+
+Importing this module registers hooks for:
+- pandas DataFrames: rows are read from tuples that are built once per dataframe, instead of building a pandas Series for every row. Entries are `RowView` objects, and locations are column names.
+- lists of dicts: each record is flattened once into a `FlatRecord` that maps key path tuples to values, so that values are looked up directly instead of walking down the record for every location. The flattened records of the most recently used lists are cached, so that a record that is read again, e.g. by `make_indexed_identify` and then on every hit, isn't flattened again.
+- NumPy structured (record) arrays: entries are the array's records, and locations are field names.
+
+Registrations here replace any registrations for the same types made before importing this module, such as the ones in ``lineage_tracer_demo.py``.
+"""
+
+from collections import OrderedDict
+from typing import Any, Iterator, Tuple
+import weakref
+import numpy as np
+import pandas as pd
+from lineage_tracer_core import get_entry, get_value, make_idx_iter, make_loc_iter
+from mappings import flatten_dict
+
+class RowView:
+    """
+    A lightweight view of a dataframe row, made up of the row's values and a shared mapping from column names to positions.
+
+    Parameters
+    ----------
+    values : tuple
+        The values of the row.
+    positions : dict
+        The position of each column name in `values`.
+    """
+    __slots__ = ('values', 'positions')
+
+    def __init__(self, values: tuple, positions: dict):
+        self.values = values
+        self.positions = positions
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({dict(zip(self.positions, self.values))})"
+
+class FlatRecord(dict):
+    """A record that has been flattened into a dict from key path tuples to values, as done by `mappings.flatten_dict`."""
+
+_frame_cache: 'dict[int, Tuple[Tuple[int, int], dict, list]]' = {}
+
+def _frame_rows(dataset: pd.DataFrame) -> 'Tuple[dict, list]':
+    """Get the column positions and row tuples of a dataframe, which are built on first access and cached for as long as the dataframe exists."""
+    key = id(dataset)
+    cached = _frame_cache.get(key)
+    if cached is None or cached[0] != dataset.shape:
+        if cached is None:
+            weakref.finalize(dataset, _frame_cache.pop, key, None)
+        positions = {column: position for position, column in enumerate(dataset.columns)}
+        cached = (dataset.shape, positions, list(dataset.itertuples(index=False, name=None)))
+        _frame_cache[key] = cached
+    return cached[1], cached[2]
+
+# lists can't be weakly referenced, so the flattened records of only a few lists are kept, together with the lists themselves so that their ids can't be reused
+_list_cache: 'OrderedDict[int, Tuple[list, dict]]' = OrderedDict()
+LIST_CACHE_SIZE = 8
+
+def _flat_record(dataset: list, idx: int) -> 'FlatRecord':
+    """Get the flattened record at a position in a list, which is flattened on first access and cached together with the record it was flattened from, so that replacing the record invalidates it."""
+    key = id(dataset)
+    cached = _list_cache.get(key)
+    if cached is None or cached[0] is not dataset:
+        cached = (dataset, {})
+        _list_cache[key] = cached
+        if len(_list_cache) > LIST_CACHE_SIZE:
+            _list_cache.popitem(last=False)
+    else:
+        _list_cache.move_to_end(key)
+    record = dataset[idx]
+    flattened = cached[1].get(idx)
+    if flattened is None or flattened[0] is not record:
+        flattened = (record, FlatRecord(flatten_dict(record)))
+        cached[1][idx] = flattened
+    return flattened[1]
+
+def clear_frame_cache():
+    """Clear the cached rows of all dataframes and the flattened records of all lists, e.g. after modifying a dataframe in place without changing its shape, or a record of a list in place."""
+    _frame_cache.clear()
+    _list_cache.clear()
+
+@make_idx_iter.register
+def _(dataset: pd.DataFrame) -> Iterator:
+    """Iterates over the positions of the rows in a dataframe."""
+    return iter(range(len(dataset)))
+
+@get_entry.register
+def _(dataset: pd.DataFrame, idx: int) -> RowView:
+    """Returns a view of the row at the given position in a dataframe."""
+    positions, rows = _frame_rows(dataset)
+    return RowView(rows[idx], positions)
+# test_get_entry_df = get_entry(pd.DataFrame({'c1': [10, 11, 12], 'c2': [100, 110, 120]}), 1)
+
+@make_loc_iter.register
+def _(entry: RowView) -> Iterator:
+    """Iterates over the column names of a dataframe row."""
+    return iter(entry.positions)
+
+@get_value.register
+def _(entry: RowView, location: Any) -> Any:
+    """Returns the value of a dataframe row at the given column name."""
+    return entry.values[entry.positions[location]]
+# test_get_value_row = get_value(get_entry(pd.DataFrame({'c1': [10, 11, 12], 'c2': [100, 110, 120]}), 1), 'c2')
+
+@make_idx_iter.register
+def _(dataset: list) -> Iterator:
+    """Iterates over the positions of the records in a list."""
+    return iter(range(len(dataset)))
+
+@get_entry.register
+def _(dataset: list, idx: int) -> FlatRecord:
+    """Returns the record at the given position in a list of dicts, flattened into key path tuples."""
+    return _flat_record(dataset, idx)
+# test_get_entry_list = get_entry([{'c1': 10, 'c2': {'c3': [3, 4]}}], 0)
+
+@make_loc_iter.register
+def _(entry: FlatRecord) -> Iterator:
+    """Iterates over the key paths of a flattened record."""
+    return iter(entry)
+
+@get_value.register
+def _(entry: FlatRecord, location: Any) -> Any:
+    """Returns the value of a flattened record at the given key path, which can be a tuple or a list."""
+    return entry[tuple(location)]
+
+@make_idx_iter.register
+def _(dataset: np.ndarray) -> Iterator:
+    """Iterates over the positions of the records in a structured array."""
+    if dataset.dtype.names is None:
+        raise NotImplementedError('make_idx_iter is only implemented for structured arrays, not for arrays of type: {}'.format(dataset.dtype))
+    return iter(range(len(dataset)))
+
+@get_entry.register
+def _(dataset: np.ndarray, idx: int) -> np.void:
+    """Returns the record at the given position in a structured array."""
+    if dataset.dtype.names is None:
+        raise NotImplementedError('`get_entry` is only implemented for structured arrays, not for arrays of type: {}'.format(dataset.dtype))
+    return dataset[idx]
+# test_get_entry_recarray = get_entry(np.rec.fromrecords([(10, 100.0), (11, 110.0)], names='c1,c2'), 1)
+
+@make_loc_iter.register
+def _(entry: np.void) -> Iterator:
+    """Iterates over the field names of a structured array record."""
+    return iter(entry.dtype.names)
+
+@get_value.register
+def _(entry: np.void, location: str) -> Any:
+    """Returns the value of a structured array record at the given field name."""
+    return entry[location]
@@ -0,0 +1,154 @@
+"""
+This module provides an incremental version of `trace` from ``lineage_tracer_core.py``, for re-running traces on datasets where only a small fraction of entries change between runs.
+
+Every target entry, and the lookup entry it is identified with, is fingerprinted. The fingerprints are stored in a `TraceState` together with the trace results, and the next run only re-traces target entries whose fingerprint changed, or whose identified lookup entry or its fingerprint changed. The results of all other entries are carried over from the previous run.
+The matcher and the arguments of `trace` are fingerprinted too, and changing them re-traces every entry.
+"""
+
+from dataclasses import dataclass, field
+from functools import partial
+import hashlib
+import pickle
+import sys
+from types import CodeType
+from pathlib import Path
+from typing import Any, Callable, Tuple, Union
+import pandas as pd
+from hashing import stable_hash
+from lineage_tracer_core import MATCH_COLUMNS, MatchMemo, get_entry, get_value, make_idx_iter, make_loc_iter, trace
+
+def fingerprint_entry(entry: Any) -> str:
+    """Compute a fingerprint of an entry from all of its locations and values, using the registered `make_loc_iter` and `get_value` hooks.
+    The locations and values are pickled, so the fingerprint is lossless: values of different types, such as a timestamp and its string, and large arrays that differ in a single element, get different fingerprints. Equal values can get different fingerprints, e.g. after upgrading the library that defines their type, which only causes their entries to be traced again. Entries with values that can't be pickled raise an error, so that they are traced again on every run."""
+    pickled = pickle.dumps([(location, get_value(entry, location)) for location in make_loc_iter(entry)], protocol=4)
+    return hashlib.blake2b(pickled, digest_size=16).hexdigest()
+# test_fingerprint_entry = fingerprint_entry({'c1': 10, 'c2': {'c3': [3, 4]}})
+
+def _describe(value: Any, seen: 'Union[set, None]'=None) -> Any:
+    """Describe a value as JSON serializable data for `fingerprint_config`. Functions are described by their name, bytecode, constants, defaults and closure, so that the description changes when they are edited but not between runs."""
+    seen = set() if seen is None else seen
+    if id(value) in seen:
+        # e.g. a recursive function in its own closure
+        return 'recursive'
+    if isinstance(value, MatchMemo):
+        return _describe(value.is_match, seen)
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    seen = seen | {id(value)}
+    if isinstance(value, partial):
+        return ['partial', _describe(value.func, seen), _describe(value.args, seen), _describe(value.keywords, seen)]
+    if isinstance(value, CodeType):
+        return ['code', value.co_code.hex(), _describe(value.co_consts, seen), list(value.co_names)]
+    if hasattr(value, '__func__') and hasattr(value, '__self__'):
+        return ['method', _describe(value.__func__, seen), _describe(value.__self__, seen)]
+    if hasattr(value, '__code__'):
+        closure = [cell.cell_contents for cell in value.__closure__ or ()]
+        return ['function', value.__module__, value.__qualname__, _describe(value.__code__, seen), _describe(value.__defaults__, seen), _describe(value.__kwdefaults__, seen), _describe(closure, seen)]
+    if isinstance(value, (list, tuple)):
+        return [_describe(item, seen) for item in value]
+    if isinstance(value, dict):
+        return {str(key): _describe(item, seen) for key, item in value.items()}
+    # other objects, e.g. callable class instances, fall back to their representation, which may include their id and force a full re-trace on every run
+    return repr(value)
+
+def fingerprint_config(is_match: 'Callable[[Any, Any, Any, Any], Tuple[bool, str]]', trace_kwargs: dict) -> str:
+    """Compute a fingerprint of a matcher and the arguments of `trace` that the matches of a trace depend on."""
+    return stable_hash([_describe(is_match), _describe(trace_kwargs)])
+
+@dataclass
+class TraceState:
+    """
+    The results of a trace, together with the fingerprints of the entries they were computed from.
+
+    Attributes
+    ----------
+    fingerprints : dict
+        For each traced target index, a tuple of the target entry's fingerprint, the identified lookup index, and the lookup entry's fingerprint.
+    matches : pd.DataFrame
+        The matches found by the trace, in the format returned by `trace`.
+    config : str, optional
+        The fingerprint of the matcher and the arguments of `trace` that the matches were found with, from `fingerprint_config`.
+    """
+    fingerprints: dict = field(default_factory=dict)
+    matches: pd.DataFrame = field(default_factory=lambda: pd.DataFrame(columns=MATCH_COLUMNS))
+    config: 'Union[str, None]' = None
+
+    def save(self, path: 'Union[str, Path]'):
+        """Save the state to a file."""
+        with open(path, 'wb') as file:
+            pickle.dump(self, file)
+
+    @classmethod
+    def load(cls, path: 'Union[str, Path]') -> 'TraceState':
+        """Load a state saved with `save`."""
+        with open(path, 'rb') as file:
+            return pickle.load(file)
+
+def trace_incremental(target: Any, lookup: Any, identify: 'Callable[[Any, Any, Any], Any]', is_match: 'Callable[[Any, Any, Any, Any], Tuple[bool, str]]', state: 'Union[TraceState, None]'=None, fingerprint: 'Callable[[Any], str]'=fingerprint_entry, **trace_kwargs) -> 'Tuple[pd.DataFrame, TraceState]':
+    """Trace only the target entries that changed since the trace that produced `state`, and merge the results with the previous results of the unchanged entries.
+    - The target dataset must support random access with `get_entry`, since only some of its entries are re-traced.
+    - Target entries that no longer exist are dropped from the results.
+    - Only entries that were traced to the end without errors are fingerprinted, so entries where `is_match` failed, or that were not reached because the trace was interrupted, are traced again next time.
+    - If `is_match` or `trace_kwargs` changed, e.g. because the matcher was fixed, all entries are traced again.
+
+    Parameters
+    ----------
+    target : Any
+        The dataset to be traced.
+    lookup : Any
+        The dataset where the information in `target` will be looked up.
+    identify : Callable[[Any, Any, Any], Any]
+        A function that can be used to identify entries from the target dataset with entries in the lookup dataset. See `trace`.
+    is_match : Callable[[Any, Any, Any, Any], Tuple[bool, str]]
+        A function that can be used to check if the values at two locations are considered equal.
+    state : TraceState, optional
+        The state returned by the previous run. If not given, all entries are traced.
+    fingerprint : Callable[[Any], str], optional
+        A function that computes a fingerprint of an entry. Defaults to `fingerprint_entry`.
+    **trace_kwargs
+        Additional arguments for `trace`, such as `compatible` or `memo_size`. Profiling is not supported.
+
+    Returns
+    -------
+    Tuple[DataFrame, TraceState]
+        The merged matches, in the format returned by `trace`, and the state to pass to the next run.
+    """
+    config = fingerprint_config(is_match, trace_kwargs)
+    if state is None or state.config != config:
+        state = TraceState()
+    fingerprints = {}
+    order = {}
+    changed = []
+    for target_idx in make_idx_iter(target):
+        order[target_idx] = len(order)
+        try:
+            target_entry = get_entry(target, target_idx)
+            identified = identify(lookup, target_idx, target_entry)
+            if identified is None:
+                record = (fingerprint(target_entry), None, None)
+            else:
+                lookup_idx, lookup_entry = identified
+                record = (fingerprint(target_entry), lookup_idx, fingerprint(lookup_entry))
+        except KeyboardInterrupt:
+            raise
+        except:
+            # leave the entry without a fingerprint so that it is traced again next time, and let `trace` report the error
+            print(f"Error: {sys.exc_info()[0]}. {sys.exc_info()[1]}, line: {sys.exc_info()[2].tb_lineno}")
+            print(f"Error fingerprinting target entry {target_idx}. Re-tracing it.")
+            changed.append(target_idx)
+            continue
+        fingerprints[target_idx] = record
+        if state.fingerprints.get(target_idx) != record:
+            changed.append(target_idx)
+    print(f"Re-tracing {len(changed)} changed entries out of {len(order)} entries in the target dataset.")
+
+    completed = []
+    retraced = trace(target, lookup, identify, is_match, indices=changed, completed=completed, **trace_kwargs)
+    changed = set(changed)
+    for target_idx in changed.difference(completed):
+        fingerprints.pop(target_idx, None)
+    previous = state.matches[state.matches['target_idx'].map(lambda target_idx: target_idx in order and target_idx not in changed)]
+    matches = pd.concat([previous, retraced], ignore_index=True) if len(previous) else retraced
+    positions = matches['target_idx'].map(order)
+    matches = matches.iloc[positions.argsort(kind='stable')].reset_index(drop=True)
+    return matches, TraceState(fingerprints, matches, config)
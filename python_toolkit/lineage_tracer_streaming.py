@@ -0,0 +1,162 @@
+"""
+This module provides dataset adapters for running `trace` from ``lineage_tracer_core.py`` on files that are too large to be loaded into memory.
+
+- `ChunkedCsvTarget` and `JsonlTarget` stream a `target` dataset from a CSV or JSONL file. They only support sequential access, i.e. `get_entry` can only be called for the index most recently yielded by `make_idx_iter`, which is how `trace` traverses the `target`.
+- `JsonlLookup` serves a `lookup` dataset from a memory-mapped JSONL file with a `JsonlStore` from ``jsonl_store.py``, using an index of the byte offsets of its lines, so that `identify` and `get_entry` can access any record while only parsing the records they touch.
+- `JsonArrayLookup` does the same for a single JSON document holding an array of records, using the byte spans of the records found by streaming through the document once, e.g. with `json_stream.iter_array_spans` in ``json/json_stream.py``.
+
+Entries are `RowView` and `FlatRecord` objects from ``lineage_tracer_hooks.py``, so the hooks registered there are used for their locations and values.
+"""
+
+import json
+from itertools import chain
+from pathlib import Path
+from typing import Any, Callable, Iterable, Iterator, Tuple, Union
+import numpy as np
+import pandas as pd
+from jsonl_store import JsonlStore, default_decoder
+from lineage_tracer_core import get_entry, make_idx_iter
+from lineage_tracer_hooks import FlatRecord, RowView
+from mappings import flatten_dict
+
+class ChunkedCsvTarget:
+    """
+    A target dataset that is read from a CSV file in chunks of rows. Indices are row numbers across the whole file.
+
+    Parameters
+    ----------
+    path : Union[str, Path]
+        The path to the CSV file.
+    chunksize : int, optional
+        The number of rows to read at a time. Defaults to 100000.
+    **read_csv_kwargs
+        Additional arguments for `pd.read_csv`.
+    """
+
+    def __init__(self, path: 'Union[str, Path]', chunksize: int=100000, **read_csv_kwargs):
+        self.path = path
+        self.chunksize = chunksize
+        self.read_csv_kwargs = read_csv_kwargs
+        self._chunk_start = 0
+        self._positions: dict = {}
+        self._rows: list = []
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.path})"
+
+@make_idx_iter.register
+def _(dataset: ChunkedCsvTarget) -> Iterator:
+    """Iterates over the row numbers of a chunked CSV file, reading the next chunk whenever the current one is exhausted."""
+    def _iterate() -> Iterator:
+        chunk_start = 0
+        for chunk in pd.read_csv(dataset.path, chunksize=dataset.chunksize, **dataset.read_csv_kwargs):
+            dataset._chunk_start = chunk_start
+            dataset._positions = {column: position for position, column in enumerate(chunk.columns)}
+            dataset._rows = list(chunk.itertuples(index=False, name=None))
+            yield from range(chunk_start, chunk_start + len(chunk))
+            chunk_start += len(chunk)
+    return _iterate()
+
+@get_entry.register
+def _(dataset: ChunkedCsvTarget, idx: int) -> RowView:
+    """Returns a view of the row with the given row number, which must be in the chunk currently being read."""
+    position = idx - dataset._chunk_start
+    if not 0 <= position < len(dataset._rows):
+        raise IndexError(f"Row {idx} is not in the current chunk of {dataset}; chunked datasets only support sequential access")
+    return RowView(dataset._rows[position], dataset._positions)
+
+class JsonlTarget:
+    """
+    A target dataset that is read from a JSONL file one line at a time. Indices are the numbers of the non-empty lines in the file.
+
+    Parameters
+    ----------
+    path : Union[str, Path]
+        The path to the JSONL file.
+    """
+
+    def __init__(self, path: 'Union[str, Path]'):
+        self.path = path
+        self._idx = None
+        self._entry = None
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.path})"
+
+@make_idx_iter.register
+def _(dataset: JsonlTarget) -> Iterator:
+    """Iterates over the record numbers of a JSONL file, parsing each record as it is reached."""
+    def _iterate() -> Iterator:
+        with open(dataset.path, 'rb') as file:
+            idx = 0
+            for line in file:
+                if not line.strip():
+                    continue
+                dataset._idx = idx
+                dataset._entry = FlatRecord(flatten_dict(json.loads(line)))
+                yield idx
+                idx += 1
+    return _iterate()
+
+@get_entry.register
+def _(dataset: JsonlTarget, idx: int) -> FlatRecord:
+    """Returns the flattened record with the given record number, which must be the record currently being read."""
+    if idx != dataset._idx:
+        raise IndexError(f"Record {idx} is not the current record of {dataset}; streamed datasets only support sequential access")
+    return dataset._entry
+
+class JsonlLookup(JsonlStore):
+    """
+    A lookup dataset served from a memory-mapped JSONL file. Indices are the numbers of the non-empty lines in the file.
+
+    This is a `JsonlStore` whose index is only saved if `index_path` is given. A saved index is rebuilt if the file's size or modification time has changed.
+
+    Parameters
+    ----------
+    path : Union[str, Path]
+        The path to the JSONL file.
+    index_path : Union[str, Path], optional
+        Where to save and load the line offset index (a `.npz` file). If not given, the index is only kept in memory.
+    block_size : int, optional
+        The number of bytes scanned at a time when building the index. Defaults to 64 MiB.
+    decoder : Callable[[bytes], Any], optional
+        The function used to parse a record. Defaults to `orjson.loads` if orjson is installed, and `json.loads` otherwise.
+    """
+
+    def __init__(self, path: 'Union[str, Path]', index_path: 'Union[str, Path, None]'=None, block_size: int=64 * 2**20, decoder: 'Callable[[bytes], Any]'=default_decoder):
+        super().__init__(path, index_path, persist_index=index_path is not None, decoder=decoder, block_size=block_size)
+
+@make_idx_iter.register
+def _(dataset: JsonlLookup) -> Iterator:
+    """Iterates over the record numbers of a memory-mapped JSONL file."""
+    return iter(range(len(dataset)))
+
+@get_entry.register
+def _(dataset: JsonlLookup, idx: int) -> FlatRecord:
+    """Parses and flattens the record with the given record number in a memory-mapped JSONL file."""
+    return FlatRecord(flatten_dict(dataset[idx]))
+
+class JsonArrayLookup(JsonlLookup):
+    """
+    A lookup dataset served from the records of an array in a memory-mapped JSON document. Indices are the positions of the records in the array.
+
+    Parameters
+    ----------
+    path : Union[str, Path]
+        The path to the JSON document.
+    spans : Iterable[Tuple[int, int]]
+        The start and end byte offsets of the records, e.g. `json_stream.iter_array_spans(path)`. It is only consumed if there is no saved index, so a lazy iterator avoids streaming through the document again in later runs.
+    index_path : Union[str, Path], optional
+        Where to save and load the record offset index (a `.npz` file). If not given, the index is only kept in memory.
+    decoder : Callable[[bytes], Any], optional
+        The function used to parse a record. Defaults to `orjson.loads` if orjson is installed, and `json.loads` otherwise.
+    """
+
+    def __init__(self, path: 'Union[str, Path]', spans: 'Iterable[Tuple[int, int]]', index_path: 'Union[str, Path, None]'=None, decoder: 'Callable[[bytes], Any]'=default_decoder):
+        self._spans = spans
+        super().__init__(path, index_path, decoder=decoder)
+
+    def _build_index(self, block_size: int) -> tuple:
+        """Collect the start and end offsets of the records from the given spans."""
+        offsets = np.fromiter(chain.from_iterable(self._spans), dtype=np.int64).reshape(-1, 2)
+        return offsets[:, 0].copy(), offsets[:, 1].copy()
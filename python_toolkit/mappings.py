@@ -1,4 +1,39 @@
-from typing import Any, Union
+from typing import Any, Callable, Iterable, Iterator, Tuple, Union
+
+
+def iter_flatten(d: Any, mapping_types: tuple=(dict,), sequence_types: tuple=(list,), atomic_types: tuple=(str, bytes)) -> "Iterator[Tuple[tuple, Any]]":
+    """
+    Iterate over the (key path, value) pairs of all leaf values in a nested structure of mappings and sequences, depth first.
+
+    This is the flattening engine behind `flatten_dict`, `flatten_records` and `utilities.flatten_json`. It walks the structure with an explicit stack instead of recursion, and builds the key path prefix of each container only once, so it has no recursion limit and costs time linear in the size of the output. Empty containers have no leaves, so they are skipped. A value that is not a container is a leaf with an empty key path.
+
+    >>> list(iter_flatten({'a': 3, 'b': [1, {'c': 2}]}))
+    [(('a',), 3), (('b', 0), 1), (('b', 1, 'c'), 2)]
+    """
+    def _items(x: Any) -> "Union[Iterator, None]":
+        if isinstance(x, mapping_types):
+            return iter(x.items())
+        if isinstance(x, sequence_types) and not isinstance(x, atomic_types):
+            return enumerate(x)
+        return None
+
+    items = _items(d)
+    if items is None:
+        yield (), d
+        return
+    stack = [((), items)]
+    while stack:
+        prefix, items = stack[-1]
+        for k, v in items:
+            child_items = _items(v)
+            if child_items is None:
+                yield (*prefix, k), v
+            else:
+                # descend into the child; the parent's iterator resumes where it left off once the child is exhausted
+                stack.append(((*prefix, k), child_items))
+                break
+        else:
+            stack.pop()
 
 
 def flatten_dict(d: "Union[dict, list[dict]]") -> dict:
@@ -8,18 +43,60 @@ def flatten_dict(d: "Union[dict, list[dict]]") -> dict:
     >>> flatten_dict({'a': 3, 'b': [1, 2, 3], 'c': {'d': 3}})
     {('a',): 3, ('b', 0): 1, ('b', 1): 2, ('b', 2): 3, ('c', 'd'): 3}
     """
-    result = {}
-    items = ()
-    if isinstance(d, dict):
-        items = d.items()
-    if isinstance(d, list):
-        items = enumerate(d)
-    for k, v in items:
-        if isinstance(v, (dict, list)):
-            result.update({(k, *subk): subv for subk, subv in flatten_dict(v).items()})
+    if not isinstance(d, (dict, list)):
+        return {}
+    return dict(iter_flatten(d))
+
+
+def flatten_records(records: "Iterable[Union[dict, list]]", sep: "Union[str, None]"=None, as_frame: bool=False) -> "Union[dict, Any]":
+    """
+    Flatten a batch of records into columns, mapping each key path to a list of values that is aligned with the records. Records that don't have a key path get None in its column.
+
+    Parameters
+    ----------
+    records : Iterable[Union[dict, list]]
+        The records to flatten. They are consumed one at a time, so this can be a generator.
+    sep : str, optional
+        If given, key paths are joined into strings with this separator, e.g. to use them as column names.
+    as_frame : bool, optional
+        Whether to return a pandas DataFrame instead of a dict of columns. Key paths are joined with '.' if `sep` is not given.
+
+    Returns
+    -------
+    Union[dict, pd.DataFrame]
+        The columns of the flattened records, in order of first appearance.
+
+    >>> flatten_records([{'a': 1, 'b': {'c': 2}}, {'a': 3, 'd': [4]}])
+    {('a',): [1, 3], ('b', 'c'): [2, None], ('d', 0): [None, 4]}
+    """
+    # collect the row numbers and values of each column, and only fill in the gaps once the number of records is known
+    rows: "dict[tuple, list[int]]" = {}
+    values: "dict[tuple, list]" = {}
+    record_count = 0
+    for row, record in enumerate(records):
+        record_count += 1
+        for path, value in iter_flatten(record):
+            if path not in rows:
+                rows[path], values[path] = [], []
+            rows[path].append(row)
+            values[path].append(value)
+    columns = {}
+    for path, column_rows in rows.items():
+        if len(column_rows) == record_count:
+            columns[path] = values[path]
         else:
-            result[(k,)] = v
-    return result
+            column = [None] * record_count
+            for row, value in zip(column_rows, values[path]):
+                column[row] = value
+            columns[path] = column
+    if as_frame and sep is None:
+        sep = '.'
+    if sep is not None:
+        columns = {sep.join(map(str, path)): column for path, column in columns.items()}
+    if as_frame:
+        import pandas as pd
+        return pd.DataFrame(columns, index=range(record_count))
+    return columns
 
 
 def get_key_value(vals: "Union[dict, list, tuple]", key_path: tuple) -> Any:
@@ -37,11 +114,140 @@ def get_key_value(vals: "Union[dict, list, tuple]", key_path: tuple) -> Any:
         return None
 
 
-# use `defaultdict` to create a dictionary with default values
-from collections import defaultdict
 
-d = defaultdict(list)
-# since the default value here is a list, you can append to it without explicitly creating an empty list first
-d["a"].append(1)
-d["a"].append(2)
-print(d)  # defaultdict(<class 'list'>, {'a': [1, 2]})
+# each trie level is one more level of indentation in the generated function, and Python allows at most 100, so deeper key paths are walked one key at a time
+_MAX_TRIE_DEPTH = 64
+
+
+def _walk(vals: "Union[dict, list, tuple]", key_path: tuple) -> Any:
+    """Get the value at a key path by walking down it one key at a time, with the same semantics as `get_key_value`, for key paths too deep to compile."""
+    for key in key_path:
+        try:
+            vals = vals[key]
+        except (KeyError, IndexError):
+            return None
+    return vals
+
+
+def _iter_suffixes(node: tuple, suffix: tuple=()) -> "Iterator[Tuple[int, tuple]]":
+    """Iterate over the positions of the key paths below a trie node, with the rest of their key paths from the node."""
+    children, outputs = node
+    for position in outputs:
+        yield position, suffix
+    for key, child in children.items():
+        yield from _iter_suffixes(child, (*suffix, key))
+
+
+def _compile_trie(root: tuple, path_count: int) -> "Callable[[Any], tuple]":
+    """Generate the source of a function that walks a key path trie over a record, with one nested lookup per trie node, and compile it. Below `_MAX_TRIE_DEPTH`, the rest of each key path is walked with `_walk`."""
+    keys = []
+    suffixes = []
+    lines = ["def access(v0):", f"    {' = '.join(f'o{i}' for i in range(path_count))} = None" if path_count else "    pass"]
+
+    def _emit(node: tuple, depth: int, indent: str):
+        children, outputs = node
+        if depth >= _MAX_TRIE_DEPTH:
+            for position, suffix in _iter_suffixes(node):
+                suffixes.append(suffix)
+                lines.append(f"{indent}o{position} = walk(v{depth}, suffixes[{len(suffixes) - 1}])")
+            return
+        for position in outputs:
+            lines.append(f"{indent}o{position} = v{depth}")
+        for key, child in children.items():
+            keys.append(key)
+            lines.extend([
+                f"{indent}try:",
+                f"{indent}    v{depth + 1} = v{depth}[keys[{len(keys) - 1}]]",
+                f"{indent}except (KeyError, IndexError):",
+                f"{indent}    pass",
+                f"{indent}else:",
+            ])
+            _emit(child, depth + 1, indent + "    ")
+            if lines[-1].endswith("else:"):
+                lines.append(f"{indent}    pass")
+
+    _emit(root, 0, "    ")
+    lines.append(f"    return ({''.join(f'o{i}, ' for i in range(path_count))})")
+    namespace = {"keys": keys, "suffixes": suffixes, "walk": _walk}
+    exec("\n".join(lines), namespace)
+    return namespace["access"]
+
+
+class KeyPathAccessor:
+    """
+    A reusable accessor that gets the values at a set of key paths from nested dictionaries, lists, or tuples, with the same semantics as `get_key_value`.
+
+    The key paths are compiled into a trie, so that key paths with a common prefix share the lookups along it, and the trie is turned into a single generated function with one nested lookup per trie node. Each record is walked only once to get the values at all key paths.
+
+    Parameters
+    ----------
+    key_paths : Iterable[tuple]
+        The key paths to get values at.
+
+    >>> accessor = KeyPathAccessor([('a',), ('c', 'd'), ('c', 'e'), ('b', 5)])
+    >>> accessor({'a': 1, 'b': [2, 3, 4], 'c': {'d': 5, 'e': 6}})
+    (1, 5, 6, None)
+    >>> accessor.extract([{'a': 1, 'c': {'d': 2}}, {'a': 3, 'b': [0, 1, 2, 3, 4, 5]}])
+    {('a',): [1, 3], ('c', 'd'): [2, None], ('c', 'e'): [None, None], ('b', 5): [None, 5]}
+    """
+
+    def __init__(self, key_paths: "Iterable[tuple]"):
+        self.key_paths = [tuple(key_path) for key_path in key_paths]
+        root = ({}, [])
+        for position, key_path in enumerate(self.key_paths):
+            node = root
+            for key in key_path:
+                node = node[0].setdefault(key, ({}, []))
+            node[1].append(position)
+        self._access = _compile_trie(root, len(self.key_paths))
+
+    def __call__(self, vals: "Union[dict, list, tuple]") -> tuple:
+        """Get the values at all key paths in a single record, in the order of the key paths. Missing values are None."""
+        return self._access(vals)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.key_paths})"
+
+    def extract(self, records: "Iterable[Union[dict, list, tuple]]", as_numpy: bool=False) -> dict:
+        """
+        Get the values at all key paths from a batch of records, as columns that are aligned with the records.
+
+        Parameters
+        ----------
+        records : Iterable[Union[dict, list, tuple]]
+            The records to get values from. They are consumed one at a time, so this can be a generator.
+        as_numpy : bool, optional
+            Whether to return each column as a NumPy array instead of a list.
+
+        Returns
+        -------
+        dict
+            A mapping from each key path to its column of values.
+        """
+        access = self._access
+        rows = [access(vals) for vals in records]
+        columns = [list(column) for column in zip(*rows)] if rows else [[] for _ in self.key_paths]
+        if as_numpy:
+            import numpy as np
+            columns = [np.asarray(column) for column in columns]
+        return dict(zip(self.key_paths, columns))
+
+
+def compile_key_paths(key_paths: "Iterable[tuple]") -> KeyPathAccessor:
+    """
+    Compile a set of key paths into a reusable accessor that gets the values at all of them in a single walk of each record. See `KeyPathAccessor`.
+
+    >>> compile_key_paths([('c', 'd'), ('a',)])({'a': 1, 'c': {'d': 5}})
+    (5, 1)
+    """
+    return KeyPathAccessor(key_paths)
+
+if __name__ == '__main__':
+    # use `defaultdict` to create a dictionary with default values
+    from collections import defaultdict
+
+    d = defaultdict(list)
+    # since the default value here is a list, you can append to it without explicitly creating an empty list first
+    d["a"].append(1)
+    d["a"].append(2)
+    print(d)  # defaultdict(<class 'list'>, {'a': [1, 2]})
@@ -1,3 +1,4 @@
+from collections import OrderedDict
 from typing import Any, Tuple, Callable
 import numpy as np
 import pandas as pd
@@ -33,4 +34,93 @@ def is_timezone_offset(dt1: pd.Timestamp, dt2: pd.Timestamp) -> 'Tuple[bool, int
 
 def is_same_up_to(x: float, y: float, n: int) -> bool:
     """Check if two numbers are the same up to a certain number of decimal places."""
-    return np.round(x, n) == np.round(y, n)
\ No newline at end of file
+    return np.round(x, n) == np.round(y, n)
+
+# Vectorized counterparts of the predicates above, for matching whole columns of values at once, e.g. as the `is_match_batch` of `trace_sampled` in ``lineage_tracer_core.py``.
+# Each column is parsed once per distinct value, and parse results are cached per column object, so reusing a column across several matchers only parses it once. The cache is keyed on the identity of the column, not its contents, so a copy of a column, or a new series built from the same values, is parsed again.
+# With `outer=True`, the pairwise matchers return a boolean match matrix of every value in `x` against every value in `y`, instead of comparing aligned values.
+# The pairwise matchers take the target and lookup locations that `trace_sampled` passes to `is_match_batch` after the columns, and ignore them, so their options are keyword-only, e.g. `is_match_batch=partial(are_same_up_to, n=2)`.
+
+_parse_cache: 'OrderedDict[Tuple[int, str], Tuple[Any, np.ndarray]]' = OrderedDict()
+PARSE_CACHE_SIZE = 64
+
+def clear_parse_cache():
+    """Clear the cached parse results of all columns, e.g. after modifying a column in place."""
+    _parse_cache.clear()
+
+def _parse_unique(values: Any, kind: str, parse: 'Callable[[pd.Index], np.ndarray]', missing: Any) -> np.ndarray:
+    """Parse each distinct value of a column once, and cache the parsed column."""
+    key = (id(values), kind)
+    cached = _parse_cache.get(key)
+    # the column itself is kept in the cache so that its id cannot be reused by another object
+    if cached is not None and cached[0] is values:
+        _parse_cache.move_to_end(key)
+        return cached[1]
+    codes, uniques = pd.factorize(pd.Series(values, dtype=object))
+    parsed_uniques = parse(uniques)
+    if not len(uniques):
+        # every value is missing, so there is nothing to index into
+        parsed = np.full(len(codes), missing, dtype=parsed_uniques.dtype)
+    else:
+        parsed = parsed_uniques[codes]
+        parsed[codes == -1] = missing
+    _parse_cache[key] = (values, parsed)
+    if len(_parse_cache) > PARSE_CACHE_SIZE:
+        _parse_cache.popitem(last=False)
+    return parsed
+
+def _parse_numbers(uniques: pd.Index) -> np.ndarray:
+    return pd.to_numeric(pd.Series(uniques, dtype=object), errors='coerce').to_numpy(dtype=float)
+
+def _parse_datetimes(uniques: pd.Index) -> np.ndarray:
+    def _wall_time(value: Any) -> Any:
+        parsed = pd.to_datetime(value, errors='coerce')
+        return parsed.replace(tzinfo=None) if not pd.isna(parsed) else pd.NaT
+    try:
+        parsed = pd.to_datetime(pd.Series(uniques, dtype=object), errors='coerce', format='mixed')
+        if parsed.dt.tz is not None:
+            parsed = parsed.dt.tz_localize(None)
+        return parsed.to_numpy(dtype='datetime64[ns]')
+    except (TypeError, ValueError, AttributeError):
+        # mixed timezones or mixed value types can't be parsed as a whole, so fall back to parsing the distinct values one by one
+        return pd.Series([_wall_time(value) for value in uniques], dtype='datetime64[ns]').to_numpy()
+
+def to_numbers(values: Any) -> np.ndarray:
+    """Parse a column of values into floats, with NaN where a value isn't a number."""
+    return _parse_unique(values, 'number', _parse_numbers, np.nan)
+
+def to_datetimes(values: Any) -> np.ndarray:
+    """Parse a column of values into naive datetimes (with their timezone dropped, as in `is_timezone_offset`), with NaT where a value isn't a datetime."""
+    return _parse_unique(values, 'datetime', _parse_datetimes, np.datetime64('NaT'))
+
+def _pair(x: np.ndarray, y: np.ndarray, outer: bool) -> 'Tuple[np.ndarray, np.ndarray]':
+    """Align two parsed columns for elementwise comparison, or broadcast them against each other for a match matrix."""
+    return (x[:, np.newaxis], y[np.newaxis, :]) if outer else (x, y)
+
+def are_numbers(values: Any) -> np.ndarray:
+    """Check which values in a column are convertible to a number. Unlike `is_number`, this also accepts strings of non-integer numbers."""
+    return ~np.isnan(to_numbers(values))
+
+def are_datetimes(values: Any) -> np.ndarray:
+    """Check which values in a column are convertible to a datetime."""
+    return ~np.isnat(to_datetimes(values))
+
+def are_ten_power(x: Any, y: Any, target_location: Any=None, lookup_location: Any=None, *, outer: bool=False) -> np.ndarray:
+    """Check which numbers in one column are off from the numbers in another by a factor of 10, 100, etc."""
+    x, y = _pair(to_numbers(x), to_numbers(y), outer)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        is_power = np.log10(np.abs(x / y)) % 1 == 0
+    return is_power & (x != 0) & (y != 0)
+
+def are_timezone_offset(x: Any, y: Any, target_location: Any=None, lookup_location: Any=None, *, outer: bool=False) -> np.ndarray:
+    """Check which datetimes in one column are separated from the datetimes in another by an integer number of hours, and less than a day."""
+    x, y = _pair(to_datetimes(x), to_datetimes(y), outer)
+    hours_diff = (x - y) / np.timedelta64(1, 'h')
+    with np.errstate(invalid='ignore'):
+        return (hours_diff % 1 == 0) & (np.abs(hours_diff) < 24)
+
+def are_same_up_to(x: Any, y: Any, target_location: Any=None, lookup_location: Any=None, *, n: int, outer: bool=False) -> np.ndarray:
+    """Check which numbers in one column are the same as the numbers in another up to a certain number of decimal places."""
+    x, y = _pair(to_numbers(x), to_numbers(y), outer)
+    return np.round(x, n) == np.round(y, n)
+# test_are_same_up_to = are_same_up_to(pd.Series([1.001, 2.5, 'a']), pd.Series([1.0, 2.49, 3]), n=2)
@@ -4,7 +4,12 @@
 
 # %%
 
-from typing import Any, Callable, Iterable, Tuple
+import hashlib
+import heapq
+import pickle
+from collections import OrderedDict
+from concurrent.futures import Executor
+from typing import Any, Callable, Hashable, Iterable, Tuple, Union
 
 test_state = 1
 
@@ -79,40 +84,280 @@ test_is_valid_True = is_valid(test_fulfillment, test_applied_updates_2, test_con
 # test_is_valid_False = is_valid(test_state, test_applied_updates_1, test_conditions)
 # test_is_valid_True = is_valid(test_state, test_applied_updates_2, test_conditions)
 
-def assemble_updates(initial_state: Any, proposed_updates: 'dict[str, Update]', desired_conditions: 'dict[str, Condition]', max_exhaustion: int=1) -> 'Tuple[Any, dict[str, Update], dict[str, Condition]]':
-    """Creates a sequence of updates that attempts to satisfy all desired conditions when applied on the state."""
+def pickle_key(state: Any) -> bytes:
+    """Fingerprint a state losslessly, by hashing its pickled bytes. Equal states may get different fingerprints, e.g. dicts with a different key order, but different states only get the same one by a 128 bit hash collision, unlike with `repr` or JSON, which shorten large arrays and merge types such as tuples and lists."""
+    return hashlib.blake2b(pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL), digest_size=16).digest()
+# test_pickle_key = pickle_key({'a': [1, 2]}) != pickle_key({'a': (1, 2)})
+
+class FulfillmentCache:
+    """
+    A bounded, least-recently-used cache of the fulfillment of conditions for states, keyed by a fingerprint of the state, so that states that are reached again are not evaluated again.
+
+    The cache is only valid for one group of conditions, e.g. the desired conditions of one `UpdateEngine`.
+
+    Parameters
+    ----------
+    maxsize : int, optional
+        The maximum number of cached fulfillments. Defaults to 10000.
+    key : Callable[[Any], Hashable], optional
+        A function that computes the fingerprint of a state. Defaults to `pickle_key`, a hash of the pickled state, which is only the same for states that unpickle to the same values, including NumPy arrays and dataframes. States whose fingerprint can't be computed, e.g. because they can't be pickled, bypass the cache.
+
+    Attributes
+    ----------
+    hits : int
+        The number of states whose fulfillment was found in the cache.
+    misses : int
+        The number of states whose fulfillment was evaluated and cached.
+    uncached : int
+        The number of states whose fulfillment was evaluated without a fingerprint.
+    """
+
+    def __init__(self, maxsize: int=10000, key: 'Union[Callable[[Any], Hashable], None]'=None):
+        self.maxsize = maxsize
+        self.key = key if key is not None else pickle_key
+        self.hits = 0
+        self.misses = 0
+        self.uncached = 0
+        self._cache: 'OrderedDict[Hashable, dict[str, float]]' = OrderedDict()
+
+    def lookup(self, state: Any) -> 'Tuple[Union[Hashable, None], Union[dict[str, float], None]]':
+        """Find the fingerprint of a state, and its cached fulfillment if any. A miss is counted once its fulfillment is stored."""
+        try:
+            key = self.key(state)
+            fulfillment = self._cache.get(key)
+        except (TypeError, ValueError, AttributeError, pickle.PicklingError):
+            return None, None
+        if fulfillment is not None:
+            self.hits += 1
+            self._cache.move_to_end(key)
+        return key, fulfillment
+
+    def store(self, key: 'Union[Hashable, None]', fulfillment: 'dict[str, float]'):
+        """Cache the fulfillment of the state with the given fingerprint, as returned by `lookup`."""
+        if key is None:
+            self.uncached += 1
+            return
+        self.misses += 1
+        self._cache[key] = fulfillment
+        if len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+
+    def __call__(self, state: Any, conditions: 'dict[str, Condition]') -> 'dict[str, float]':
+        """Find the fulfillment of the conditions for a state, from the cache if possible."""
+        key, fulfillment = self.lookup(state)
+        if fulfillment is None:
+            fulfillment = find_fulfillment(state, conditions)
+            self.store(key, fulfillment)
+        return fulfillment
+
+    @property
+    def hit_rate(self) -> float:
+        """The share of states whose fulfillment was found in the cache."""
+        calls = self.hits + self.misses + self.uncached
+        return self.hits / calls if calls else 0.0
+
+    def cache_info(self) -> dict:
+        """Get the hit, miss and size statistics of the cache."""
+        return {'hits': self.hits, 'misses': self.misses, 'uncached': self.uncached, 'hit_rate': self.hit_rate, 'maxsize': self.maxsize, 'currsize': len(self._cache)}
+
+    def clear(self):
+        """Clear the cache and its statistics."""
+        self._cache.clear()
+        self.hits = self.misses = self.uncached = 0
+
+def propose_update(update: Update, state: Any, conditions: 'Union[dict[str, Condition], None]') -> 'Tuple[Any, Union[dict[str, float], None]]':
+    """Applies an update to a state, and finds the fulfillment of the conditions for the proposed state, unless `conditions` is None. Runs in the executor of `UpdateEngine.run_pass`."""
+    proposed_state = update.apply(state)
+    if proposed_state is None or conditions is None:
+        return proposed_state, None
+    return proposed_state, find_fulfillment(proposed_state, conditions)
+
+class UpdateEngine:
+    """
+    Assembles updates with the rules of `assemble_updates`, using indexes that are built once for a group of proposed updates and desired conditions.
+
+    - Conditions are numbered, and sets of conditions are stored as bitsets (ints), so checking prerequisites and validity takes a few integer operations instead of scanning dicts.
+    - Updates are indexed by prerequisite, and each update counts its unfulfilled prerequisites. An update only becomes a candidate once its last prerequisite is fulfilled, when it joins a queue of ready updates that are considered in their proposed order. Updates whose prerequisites are never fulfilled are never looked at.
+    - The fulfillment of the current state is kept between accepted updates, so each candidate only evaluates the conditions on its proposed state.
+    - With a `FulfillmentCache`, the fulfillment of states that were reached before, e.g. in earlier passes, is not evaluated again.
+
+    Unlike a single scan over the updates in order, an update that becomes ready after updates that come later in the order were accepted is still considered in the same pass.
+    """
+    def __init__(self, proposed_updates: 'dict[str, Update]', desired_conditions: 'dict[str, Condition]', cache: 'Union[FulfillmentCache, None]'=None):
+        self.cache = cache
+        self.update_names = list(proposed_updates)
+        self.updates = list(proposed_updates.values())
+        self.conditions = desired_conditions
+        self.condition_names = list(desired_conditions)
+        self.condition_bits = [(1 << index, condition_name, condition) for index, (condition_name, condition) in enumerate(desired_conditions.items())]
+        bits = {condition_name: bit for bit, condition_name, _ in self.condition_bits}
+        self.prerequisite_masks: 'list[int]' = []
+        self.prerequisite_counts: 'list[int]' = []
+        # the positions of the updates that have each condition as a prerequisite, by the condition's bit
+        self.dependents: 'dict[int, list[int]]' = {}
+        self.roots: 'list[int]' = []
+        for position, update in enumerate(self.updates):
+            prerequisites = set(update.prerequisites)
+            mask = 0
+            for prerequisite in prerequisites:
+                mask |= bits.get(prerequisite, 0)
+            self.prerequisite_masks.append(mask)
+            if not prerequisites <= bits.keys():
+                # a prerequisite that is not a desired condition is never fulfilled
+                self.prerequisite_counts.append(-1)
+                continue
+            self.prerequisite_counts.append(len(prerequisites))
+            for prerequisite in prerequisites:
+                self.dependents.setdefault(bits[prerequisite], []).append(position)
+            if not prerequisites:
+                self.roots.append(position)
+
+    def evaluate(self, state: Any) -> 'Tuple[dict[str, float], float, int]':
+        """Find the fulfillment of the desired conditions for a state, its total, and the bitset of the conditions it fulfills."""
+        if self.cache is not None:
+            return self.score(self.cache(state, self.conditions))
+        return self.score(find_fulfillment(state, self.conditions))
+
+    def score(self, fulfillment: 'dict[str, float]') -> 'Tuple[dict[str, float], float, int]':
+        """Get the total of a fulfillment, and the bitset of the conditions it fulfills."""
+        mask = 0
+        for bit, condition_name, condition in self.condition_bits:
+            if condition.is_fulfilled(fulfillment[condition_name]):
+                mask |= bit
+        return fulfillment, sum(fulfillment.values()), mask
+
+    def names(self, mask: int) -> 'list[str]':
+        """Get the names of the conditions in a bitset."""
+        return [condition_name for bit, condition_name, _ in self.condition_bits if mask & bit]
+
+    def _release(self, new_mask: int, remaining: 'list[int]', ready: 'list[int]'):
+        """Count newly fulfilled conditions off the prerequisites of their dependent updates, and queue the updates that have none left."""
+        while new_mask:
+            bit = new_mask & -new_mask
+            new_mask ^= bit
+            for position in self.dependents.get(bit, ()):
+                remaining[position] -= 1
+                if remaining[position] == 0:
+                    heapq.heappush(ready, position)
+
+    def _evaluate_candidates(self, positions: 'list[int]', state: Any, executor: 'Union[Executor, None]') -> list:
+        """Apply the updates at the given positions to the state, and evaluate the desired conditions on the proposed states, in the executor if given."""
+        updates = [self.updates[position] for position in positions]
+        if self.cache is None:
+            if executor is None:
+                proposals = [propose_update(update, state, self.conditions) for update in updates]
+            else:
+                proposals = list(executor.map(propose_update, updates, [state] * len(updates), [self.conditions] * len(updates)))
+            return [(proposed_state, self.score(fulfillment) if proposed_state is not None else None) for proposed_state, fulfillment in proposals]
+        # with a cache, apply the updates first, and only evaluate the conditions on the proposed states that are not cached
+        if executor is None:
+            return [(proposed_state, self.evaluate(proposed_state) if proposed_state is not None else None) for proposed_state in (update.apply(state) for update in updates)]
+        proposed_states = list(executor.map(propose_update, updates, [state] * len(updates), [None] * len(updates)))
+        lookups = [self.cache.lookup(proposed_state) if proposed_state is not None else (None, None) for proposed_state, _ in proposed_states]
+        missing = [index for index, ((proposed_state, _), (_, fulfillment)) in enumerate(zip(proposed_states, lookups)) if proposed_state is not None and fulfillment is None]
+        evaluated = executor.map(find_fulfillment, [proposed_states[index][0] for index in missing], [self.conditions] * len(missing))
+        fulfillments = [fulfillment for _, fulfillment in lookups]
+        for index, fulfillment in zip(missing, evaluated):
+            self.cache.store(lookups[index][0], fulfillment)
+            fulfillments[index] = fulfillment
+        return [(proposed_state, self.score(fulfillment) if proposed_state is not None else None) for (proposed_state, _), fulfillment in zip(proposed_states, fulfillments)]
+
+    def run_pass(self, initial_state: Any, executor: 'Union[Executor, None]'=None, policy: str='first') -> 'Tuple[Any, list[int], int]':
+        """Run one pass of assembling updates from the initial state.
+
+        Parameters
+        ----------
+        initial_state : Any
+            The state to start from.
+        executor : Executor, optional
+            A thread or process pool to evaluate all ready updates on concurrently. With a process pool, the updates, conditions and states must be picklable, so their functions can't be lambdas.
+        policy : str, optional
+            Which of the updates that improve the state to apply, when several are evaluated at once:
+            - 'first': the first one in the proposed order. The improving updates after it are evaluated again on the new state.
+            - 'best': the one with the highest total fulfillment, the first one in the proposed order on ties. The other improving updates are evaluated again on the new state.
+            Without an executor, 'first' evaluates one update at a time, and 'best' evaluates all ready updates one after the other.
+
+        With an executor or the 'best' policy, `apply` is called ahead of time on updates that are not chosen, and called again once they are evaluated on a new state, and with a process pool it runs on a copy of the update. These modes therefore require pure `apply` functions, which return the same state for the same input and don't change anything, e.g. a count of their remaining uses. Only 'first' without an executor applies one update at a time, and only keeps going with the state it proposed, so exhaustible updates (whose `apply` returns None once used up) must be run that way.
+
+        Returns
+        -------
+        Tuple[Any, list[int], int]
+            The final state, the positions of the applied updates in order of application, and the bitset of the fulfilled conditions.
+        """
+        if policy not in ('first', 'best'):
+            raise ValueError(f"Unknown policy: {policy}. Expected 'first' or 'best'.")
+        remaining = list(self.prerequisite_counts)
+        ready = list(self.roots)
+        current_state = initial_state
+        current = None
+        applied = []
+        fulfilled_mask = 0
+        # the prerequisites of the applied updates, which must stay fulfilled
+        protected_mask = 0
+        while ready:
+            if executor is None and policy == 'first':
+                candidates = [heapq.heappop(ready)]
+            else:
+                candidates, ready = sorted(ready), []
+            if current is None:
+                current = self.evaluate(current_state)
+            chosen = None
+            improving = []
+            for position, (proposed_state, proposed) in zip(candidates, self._evaluate_candidates(candidates, current_state, executor)):
+                # if the proposed state is not valid or doesn't increase fulfillment, then drop the update
+                if proposed_state is None or protected_mask & ~proposed[2] or proposed[1] <= current[1]:
+                    continue
+                if chosen is None or (policy == 'best' and proposed[1] > chosen[2][1]):
+                    chosen = (position, proposed_state, proposed)
+                improving.append(position)
+                if policy == 'first':
+                    # the updates after the first improving one have not been considered yet
+                    improving.extend(candidates[candidates.index(position) + 1:])
+                    break
+            for position in improving:
+                if position != chosen[0]:
+                    heapq.heappush(ready, position)
+            if chosen is None:
+                continue
+            # otherwise, update the state and the applied updates, and queue the updates that the new conditions make ready
+            position, current_state, current = chosen
+            applied.append(position)
+            protected_mask |= self.prerequisite_masks[position]
+            new_mask = current[2] & ~fulfilled_mask
+            fulfilled_mask |= current[2]
+            self._release(new_mask, remaining, ready)
+        return current_state, applied, fulfilled_mask
+
+def assemble_updates(initial_state: Any, proposed_updates: 'dict[str, Update]', desired_conditions: 'dict[str, Condition]', max_exhaustion: int=1, executor: 'Union[Executor, None]'=None, policy: str='first', cache_size: int=0, state_key: 'Union[Callable[[Any], Hashable], None]'=None) -> 'Union[Tuple[Any, dict[str, Update], dict[str, Condition]], Tuple[Any, dict[str, Update], dict[str, Condition], dict]]':
+    """Creates a sequence of updates that attempts to satisfy all desired conditions when applied on the state.
+    Each pass starts again from the initial state, and is run by an `UpdateEngine`, so updates are only considered once their prerequisites are fulfilled.
+    With an `executor`, all ready updates are evaluated concurrently, and one of the improving updates is picked by `policy`. This applies updates that are not chosen, so it requires pure `apply` functions, and exhaustible updates must be run without an executor and with the 'first' policy. See `UpdateEngine.run_pass`.
+    Pure updates apply the same way in every pass, so with an executor or the 'best' policy, a pass that applies the same updates and fulfills the same conditions as the pass before it also counts towards `max_exhaustion`, as a pass that applies nothing does.
+    With a `cache_size`, the fulfillment of up to that many states is cached across passes in a `FulfillmentCache`, keyed by `state_key` if given, and the statistics of the cache (see `FulfillmentCache.cache_info`) are returned as a fourth element."""
+    cache = FulfillmentCache(cache_size, state_key) if cache_size else None
+    engine = UpdateEngine(proposed_updates, desired_conditions, cache)
 
     # initialize loop variables
     done = False
     exhaustion = 0
+    current_state, applied_updates, fulfilled_conditions = initial_state, {}, {}
+    # in the modes that require pure updates, a pass that repeats the previous one will repeat forever
+    pure = executor is not None or policy == 'best'
+    previous_pass = None
     while(not done):
-        was_updated = False
-        current_state = initial_state
-        applied_updates = {}
-        fulfilled_conditions = {}
-        for update_name, update in proposed_updates.items():
-            # if update's prerequisite conditions have not been fulfilled, then skip it
-            if not update.is_fulfilled(fulfilled_conditions):
-                continue
-            # otherwise, evaluate the update
-            proposed_state = update.apply(current_state)
-            if proposed_state is None:
-                continue
-            current_condition_fulfillment = find_fulfillment(current_state, desired_conditions)
-            proposed_condition_fulfillment = find_fulfillment(proposed_state, desired_conditions)
-            # if the proposed state is not valid or doesn't increase fulfillment, then skip it
-            if not is_valid(proposed_state, applied_updates, desired_conditions) \
-                or sum(proposed_condition_fulfillment.values()) <= sum(current_condition_fulfillment.values()):
-                continue
-            # otherwise, update the state and the applied updates
-            current_state = proposed_state
-            applied_updates[update_name] = update
-            new_fulfilled_conditions = {condition_name: condition for condition_name, condition in desired_conditions.items() if condition.is_fulfilled(proposed_condition_fulfillment[condition_name])}
-            fulfilled_conditions.update(new_fulfilled_conditions)
-            was_updated = True
-        # if no updates were applied, then increase exhaustion, and break the loop if exhaustion is too high
-        if not was_updated:
+        pass_state, applied_positions, fulfilled_mask = engine.run_pass(initial_state, executor, policy)
+        repeated = pure and previous_pass == (applied_positions, fulfilled_mask)
+        previous_pass = (applied_positions, fulfilled_mask)
+        # keep the results of the last pass that applied updates
+        if applied_positions:
+            current_state = pass_state
+            applied_updates = {engine.update_names[position]: engine.updates[position] for position in applied_positions}
+            fulfilled_conditions = {condition_name: desired_conditions[condition_name] for condition_name in engine.names(fulfilled_mask)}
+        # if no updates were applied, or the pass repeated the previous one, then increase exhaustion, and break the loop if exhaustion is too high
+        if not applied_positions or repeated:
             exhaustion += 1
         if exhaustion >= max_exhaustion:
             done = True
-    return current_state, applied_updates, fulfilled_conditions
\ No newline at end of file
+    if cache is not None:
+        return current_state, applied_updates, fulfilled_conditions, cache.cache_info()
+    return current_state, applied_updates, fulfilled_conditions
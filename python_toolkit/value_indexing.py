@@ -1,9 +1,270 @@
+import math
+import numbers
+import struct
+from hashlib import blake2b
+from pathlib import Path
+from typing import Any, Iterable, Union
 
-def map_by_value_index(dataset_A, dataset_B, value_index, keymap):
-    """Map records from one dataset to another via value index method."""
-    # Flatten record_data from dataset_A and dataset_B
+
+class ValueIndex:
+    """
+    A persistent index of records by the values of their fields, for repeatedly finding the records that have given values on several fields.
+
+    Each field has a hash index from its values to the ids of the records with that value, so a lookup intersects a few sets of ids, starting from the smallest, instead of scanning all records. Records can be inserted and deleted at any time, and keep the id they were inserted with.
+
+    Parameters
+    ----------
+    records : Iterable[dict], optional
+        The records to index.
+    fields : Iterable[str], optional
+        The fields to build hash indexes for. Defaults to all fields of all records. Lookups on other fields compare the values of the candidate records directly.
+
+    Attributes
+    ----------
+    records : dict[int, dict]
+        The indexed records by id, in order of insertion.
+    """
+
+    def __init__(self, records: 'Iterable[dict]'=(), fields: 'Union[Iterable[str], None]'=None):
+        self.fields = None if fields is None else frozenset(fields)
+        self.records: 'dict[int, dict]' = {}
+        self.indexes: 'dict[str, dict[Any, set[int]]]' = {}
+        self._next_id = 0
+        for record in records:
+            self.insert(record)
+
+    @classmethod
+    def from_dataset(cls, dataset: 'Iterable[dict]', fields: 'Union[Iterable[str], None]'=None) -> 'ValueIndex':
+        """Index the records in the "record_data" of each entry of a dataset, as used by `map_by_value_index`."""
+        return cls((record for sublist in dataset for record in sublist["record_data"]), fields)
+
+    def __len__(self):
+        return len(self.records)
+
+    def insert(self, record: dict) -> int:
+        """Add a record to the index, and get its id."""
+        record_id = self._next_id
+        self._next_id += 1
+        self.records[record_id] = record
+        for field, value in record.items():
+            if self.fields is None or field in self.fields:
+                self.indexes.setdefault(field, {}).setdefault(value, set()).add(record_id)
+        return record_id
+
+    def delete(self, record_id: int) -> dict:
+        """Remove the record with the given id from the index, and get the record."""
+        record = self.records.pop(record_id)
+        for field, value in record.items():
+            index = self.indexes.get(field)
+            if index is not None and value in index:
+                index[value].discard(record_id)
+                if not index[value]:
+                    del index[value]
+        return record
+
+    def lookup(self, query: dict, exact: bool=False) -> 'list[int]':
+        """Find the ids of the records that have all of the values in `query`, in order of insertion.
+
+        Parameters
+        ----------
+        query : dict
+            The values to look up, by field.
+        exact : bool, optional
+            Whether to only find records that have no fields other than the ones in `query`.
+
+        Returns
+        -------
+        list[int]
+            The ids of the matching records.
+        """
+        postings = []
+        unindexed = []
+        for field, value in query.items():
+            index = self.indexes.get(field)
+            if index is None and (self.fields is None or field in self.fields):
+                # no record has the field
+                return []
+            if index is None:
+                unindexed.append((field, value))
+                continue
+            ids = index.get(value)
+            if not ids:
+                return []
+            postings.append(ids)
+        if postings:
+            postings.sort(key=len)
+            candidates = postings[0].intersection(*postings[1:])
+        else:
+            candidates = self.records.keys()
+        records = self.records
+        return sorted(
+            record_id for record_id in candidates
+            if all(field in records[record_id] and records[record_id][field] == value for field, value in unindexed)
+            and (not exact or len(records[record_id]) == len(query))
+        )
+    # test_lookup = ValueIndex([{'a': 1, 'b': 2}, {'a': 1, 'b': 3}]).lookup({'a': 1, 'b': 3})
+
+    def lookup_batch(self, records: 'Iterable[dict]', keymap: 'Union[dict, None]'=None, exact: bool=False) -> 'list[list[int]]':
+        """Find the ids of the matching records for each of a batch of records from another dataset, whose field names are translated with `keymap`. See `lookup`."""
+        if keymap is None:
+            return [self.lookup(record, exact) for record in records]
+        return [self.lookup({keymap[field]: value for field, value in record.items()}, exact) for record in records]
+
+
+_MASK = 2**64 - 1
+
+def _normalize(value: Any) -> 'Union[bytes, None]':
+    """Get bytes that are the same for values that are equal under `==`, or None for values of other types than None, strings, bytes, real numbers, and tuples, lists and dicts of them.
+    Integral numbers, including floats such as 1.0 and bools, are written as ints, and dicts as the sorted list of their items, so that the order of their keys doesn't matter."""
+    kind = type(value)
+    if kind is str:
+        return b's' + value.encode('utf-8', 'surrogatepass')
+    if kind is int:
+        return b'i' + str(value).encode()
+    if value is None:
+        return b'n'
+    if kind is bytes:
+        return b'b' + value
+    if kind is dict:
+        items = []
+        for key, item in value.items():
+            key, item = _normalize(key), _normalize(item)
+            if key is None or item is None:
+                return None
+            items.append(len(key).to_bytes(4, 'little') + key + len(item).to_bytes(4, 'little') + item)
+        items.sort()
+        return b'd' + b''.join(items)
+    if kind is tuple or kind is list:
+        parts = [b'l' if kind is list else b't']
+        for item in value:
+            item = _normalize(item)
+            if item is None:
+                return None
+            parts.append(len(item).to_bytes(4, 'little') + item)
+        return b''.join(parts)
+    if isinstance(value, numbers.Real):
+        # floats, bools and other numbers that equal an int, which can't be converted exactly to a float when they're large
+        try:
+            integer = int(value)
+        except (OverflowError, ValueError):
+            integer = None
+        if integer is not None and integer == value:
+            return b'i' + str(integer).encode()
+        return b'f' + repr(float(value)).encode()
+    return None
+
+
+class BloomFilter:
+    """
+    A compact, approximate set of keys that can tell for certain that a key was never added, but may wrongly report that a key was added with a small probability (a false positive).
+
+    It is sized for an expected number of keys and a target false positive rate, and uses about 1.2 bytes per key for a 1% rate, so it can stand in for an exact index that doesn't fit in memory.
+    Keys are hashed with a 64 bit hash of a normalized form, which doesn't depend on the process, so a filter can be saved and loaded in another one. Keys that are equal under `==` set the same bits: dicts are hashed as the sorted list of their items, and numbers by their value, so 1, 1.0 and True are the same key.
+    Only None, strings, bytes, real numbers, and tuples, lists and dicts of them can be hashed. Once a key with other values (e.g. a date) has been added, the filter can't rule out anything and contains every key, and keys with such values are always reported as contained.
+
+    Parameters
+    ----------
+    capacity : int
+        The expected number of keys. Adding more keys increases the false positive rate.
+    error_rate : float, optional
+        The target false positive rate at `capacity` keys. Defaults to 0.01.
+
+    Attributes
+    ----------
+    bit_count : int
+        The number of bits in the filter.
+    hash_count : int
+        The number of bits set for each key.
+    count : int
+        The number of keys added.
+    unhashed : int
+        The number of keys added that couldn't be hashed. If it isn't 0, the filter contains every key.
+    """
+    _HEADER = struct.Struct('<QQQQ')
+
+    def __init__(self, capacity: int, error_rate: float=0.01):
+        capacity = max(capacity, 1)
+        self.bit_count = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.bit_count / capacity * math.log(2)))
+        self.count = 0
+        self.unhashed = 0
+        self.bits = bytearray((self.bit_count + 7) // 8)
+
+    @classmethod
+    def from_dataset(cls, dataset: 'list[dict]', error_rate: float=0.01) -> 'BloomFilter':
+        """Build a filter of the records in the "record_data" of each entry of a dataset, as used by `map_by_value_index`."""
+        bloom = cls(sum(len(sublist["record_data"]) for sublist in dataset), error_rate)
+        for sublist in dataset:
+            for record in sublist["record_data"]:
+                bloom.add(record)
+        return bloom
+
+    def _positions(self, key: Any) -> 'Union[list[int], None]':
+        """Get the bits of a key, by double hashing with the 64 bit hash of its normalized form, or None if it can't be hashed."""
+        normalized = _normalize(key)
+        if normalized is None:
+            return None
+        hashed = int.from_bytes(blake2b(normalized, digest_size=8).digest(), 'little')
+        # derive an independent odd step from the hash with the splitmix64 finalizer
+        second = (hashed ^ (hashed >> 30)) * 0xbf58476d1ce4e5b9 & _MASK
+        second = ((second ^ (second >> 27)) * 0x94d049bb133111eb & _MASK) | 1
+        return [(hashed + i * second) % self.bit_count for i in range(self.hash_count)]
+
+    def add(self, key: Any):
+        """Add a key to the filter."""
+        positions = self._positions(key)
+        if positions is None:
+            self.unhashed += 1
+        else:
+            for position in positions:
+                self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: Any) -> bool:
+        if self.unhashed:
+            return True
+        positions = self._positions(key)
+        if positions is None:
+            return True
+        bits = self.bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in positions)
+
+    def __len__(self):
+        return self.count
+
+    def to_bytes(self) -> bytes:
+        """Serialize the filter."""
+        return self._HEADER.pack(self.bit_count, self.hash_count, self.count, self.unhashed) + bytes(self.bits)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'BloomFilter':
+        """Deserialize a filter serialized with `to_bytes`."""
+        bloom = cls.__new__(cls)
+        bloom.bit_count, bloom.hash_count, bloom.count, bloom.unhashed = cls._HEADER.unpack_from(data)
+        bloom.bits = bytearray(data[cls._HEADER.size:])
+        if len(bloom.bits) != (bloom.bit_count + 7) // 8:
+            raise ValueError(f"Expected {(bloom.bit_count + 7) // 8} bytes of bits, got {len(bloom.bits)}")
+        return bloom
+
+    def save(self, path: 'Union[str, Path]'):
+        """Save the filter to a file."""
+        with open(path, 'wb') as file:
+            file.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, path: 'Union[str, Path]') -> 'BloomFilter':
+        """Load a filter saved with `save`."""
+        with open(path, 'rb') as file:
+            return cls.from_bytes(file.read())
+
+
+def map_by_value_index(dataset_A, dataset_B, value_index, keymap, index=None, bloom=None):
+    """Map records from one dataset to another via value index method.
+    - A record of dataset_B matches when it has exactly the fields and values of a record of dataset_A after applying the keymap, in any order. Earlier versions compared the ordered items of the records, so records with the same items in a different key order didn't match; they now do.
+    - Pass a `ValueIndex` of dataset_B as `index` to reuse it across calls. Without it, dataset_B is scanned once.
+    - Pass a `BloomFilter` of the records of dataset_B as `bloom` to drop records of dataset_A that have no match before looking them up. If none are left, dataset_B is not scanned at all."""
+    # Flatten record_data from dataset_A
     flattened_dataset_A = [record for sublist in dataset_A for record in sublist["record_data"]]
-    flattened_dataset_B = [record for sublist in dataset_B for record in sublist["record_data"]]
 
     # Filter dataset_A using value_index
     filtered_dataset_A = [
@@ -12,12 +273,18 @@ def map_by_value_index(dataset_A, dataset_B, value_index, keymap):
         if all(record[key] in value_index[key] for key in value_index)
     ]
 
-    # Create a set of keys from filtered_dataset_A after applying the keymap
-    mapped_keys = {tuple((keymap[k], v) for k, v in record.items()) for record in filtered_dataset_A}
+    # Apply the keymap, and drop the records that certainly have no match
+    mapped_records = [{keymap[k]: v for k, v in record.items()} for record in filtered_dataset_A]
+    if bloom is not None:
+        mapped_records = [record for record in mapped_records if record in bloom]
+    if not mapped_records:
+        return []
 
-    # Filter dataset_B using the mapped_keys
-    mapped_values = [
-        record for record in flattened_dataset_B if tuple(record.items()) in mapped_keys
-    ]
+    # Find the records of dataset_B that have exactly the fields and values of a mapped record
+    if index is None:
+        mapped_keys = {frozenset(record.items()) for record in mapped_records}
+        return [record for sublist in dataset_B for record in sublist["record_data"] if frozenset(record.items()) in mapped_keys]
+    mapped_ids = set().union(*index.lookup_batch(mapped_records, exact=True))
+    mapped_values = [index.records[record_id] for record_id in sorted(mapped_ids)]
 
-    return mapped_values
\ No newline at end of file
+    return mapped_values